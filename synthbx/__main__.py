@@ -1,16 +1,28 @@
-from synthbx.core.synthesize import synthesize
+from synthbx.core.prosynth import make_parser
+from synthbx.core.synthesize import synthesize, portfolio
 from synthbx.env.const import EFolder
 import argparse
 import os
+import shlex
 
-parser = argparse.ArgumentParser()
-parser.add_argument('-s', '--specification', required=True,
-                    help='path to the folder containing schema folder and example folder'
-                    )
-parser.add_argument('-m', '--mode', choices=['synth', 'clean', 'verify'],
-                    default='synth', )
+# options of the command itself, the others are those of the search, forwarded as given
+command = argparse.ArgumentParser(add_help=False)
+command.add_argument('-s', '--specification', required=True,
+                     help='path to the folder containing schema folder and example folder'
+                     )
+command.add_argument('-m', '--mode', choices=['synth', 'clean', 'verify'],
+                     default='synth', )
+command.add_argument('--portfolio', type=int, default=1,
+                     help='number of differently seeded syntheses raced, the first pairing a get with a put wins'
+                     )
+command.add_argument('--portfolio-config', action='append', default=[],
+                     help='extra options of portfolio runs, given after = (eg. --portfolio-config="--coprov --tiered"), '
+                          'repeated configurations are taken by the runs in turn'
+                     )
 
+parser = argparse.ArgumentParser(parents=[command, make_parser()])
 args = parser.parse_args()
+_, options = command.parse_known_args()
 
 benchmark = args.specification
 mode = args.mode
@@ -18,7 +30,11 @@ mode = args.mode
 path = benchmark
 
 if mode == 'synth':
-    synthesize(path)
+    if args.portfolio > 1:
+        portfolio(path, options, args.portfolio,
+                  [shlex.split(config) for config in args.portfolio_config])
+    else:
+        synthesize(path, options)
 elif mode == 'clean':
     os.system(
         f'rm -rf {path}/{EFolder.SYNTH} {path}/{EFolder.RESULT} 2> /dev/null'
@@ -0,0 +1,102 @@
+import hashlib
+import os
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    Size-bounded mapping evicting the least recently used entry, with hit/miss counters
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, default=None):
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        self.misses += 1
+        return default
+
+    def put(self, key, value):
+        if self.capacity <= 0:
+            return
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        return f'hits: {self.hits}, misses: {self.misses}, ' \
+            f'evictions: {self.evictions}, size: {len(self.entries)}/{self.capacity}'
+
+
+def facts_digest(problem_dir):
+    """
+    Content hash of the input facts of problem_dir, Rule.facts excluded
+    """
+    h = hashlib.sha256()
+    for f in sorted(os.listdir(problem_dir)):
+        if f.endswith('.facts') and f != 'Rule.facts':
+            h.update(f.encode())
+            with open(f'{problem_dir}/{f}', 'rb') as fr:
+                h.update(fr.read())
+    return h.hexdigest()
+
+
+def problem_digest(problem_dir, *files):
+    """
+    Content hash of files and of the facts and expected outputs of problem_dir, Rule.facts excluded
+    """
+    h = hashlib.sha256()
+    for f in files:
+        with open(f, 'rb') as fr:
+            h.update(fr.read())
+    for f in sorted(os.listdir(problem_dir)):
+        if f.endswith(('.facts', '.expected')) and f != 'Rule.facts':
+            h.update(f.encode())
+            with open(f'{problem_dir}/{f}', 'rb') as fr:
+                h.update(fr.read())
+    return h.hexdigest()
+
+
+class EvaluationCache(LRUCache):
+    """
+    Output relations of the candidate program by enabled rule set
+    """
+
+    def __init__(self, capacity, problem_dir):
+        super().__init__(capacity)
+        self.digest = facts_digest(problem_dir)
+
+    def key(self, rule_set):
+        return (frozenset(rule_set), self.digest)
+
+
+class ProvenanceCache(LRUCache):
+    """
+    Rules of the proof tree of a tuple by the enabled rules of the dependency cone of its relation
+    """
+
+    def __init__(self, capacity, cones):
+        super().__init__(capacity)
+        self.cones = cones
+
+    def key(self, rel_name, t, rule_set):
+        rule_set = frozenset(str(r) for r in rule_set)
+        cone = self.cones.get(rel_name)
+        if cone is not None:
+            rule_set &= cone
+        return (rel_name, t, rule_set)
@@ -0,0 +1,134 @@
+import json
+import os
+
+
+# folder of the synthesis workspace keeping learned clauses across runs
+CLAUSE_FOLDER = '_clauses'
+# folder of the synthesis workspace keeping the last checkpoint of an unfinished search
+CHECKPOINT_FOLDER = '_checkpoint'
+
+
+class ConstraintStore(object):
+    """
+    Visited candidates, solutions and clauses of the synthesis loop in hash sets,
+    rule sets encoded as integer bitsets so that every check is O(1)
+    """
+
+    def __init__(self, rule_names):
+        self.bits = {name: 1 << i for i, name in enumerate(sorted(rule_names))}
+        self.visited = set()
+        self.solutions = set()
+        self.clauses = set()
+        self.reasons = {}
+        # clauses only holding for this run, never saved
+        self.local = set()
+        self.duplicates = 0
+
+    def encode(self, rule_set):
+        ans = 0
+        for name in rule_set:
+            ans |= self.bits[name]
+        return ans
+
+    def decode(self, bits):
+        return {name for name, bit in self.bits.items() if bits & bit}
+
+    def is_visited(self, rule_set):
+        return self.encode(rule_set) in self.visited
+
+    def visit(self, rule_set):
+        self.visited.add(self.encode(rule_set))
+
+    def add_solution(self, rule_set):
+        """
+        Record a solution, return False if it was already found
+        """
+        key = self.encode(rule_set)
+        if key in self.solutions:
+            return False
+        self.solutions.add(key)
+        return True
+
+    def add_clause(self, pos=(), neg=(), reason=None, local=False):
+        """
+        Record the clause (some rule of pos is enabled or some rule of neg is disabled)
+        and why it was learned, return False if it was already added.
+        A local clause is not a consequence of the inputs (eg. it excludes a visited candidate)
+        """
+        key = (self.encode(pos), self.encode(neg))
+        if key in self.clauses:
+            self.duplicates += 1
+            return False
+        self.clauses.add(key)
+        self.reasons[key] = reason
+        if local:
+            self.local.add(key)
+        return True
+
+    def discard(self, clauses):
+        """
+        Remove the clauses (pos, neg), eg. heuristic ones found to rule out every candidate
+        """
+        for pos, neg in clauses:
+            key = (self.encode(pos), self.encode(neg))
+            self.clauses.discard(key)
+            self.reasons.pop(key, None)
+            self.local.discard(key)
+
+    def explained_clauses(self):
+        """
+        Clauses as (pos, neg, reason), in a fixed order
+        """
+        return [(self.decode(pos), self.decode(neg), self.reasons.get((pos, neg)))
+                for pos, neg in sorted(self.clauses)]
+
+    def save(self, filename):
+        """
+        Write the clauses that are not local as JSON lists of rule names, with their reasons
+        """
+        clauses = sorted([sorted(self.decode(pos)), sorted(self.decode(neg)), self.reasons.get((pos, neg))]
+                         for pos, neg in self.clauses if (pos, neg) not in self.local)
+        os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+        with open(filename, 'w') as fw:
+            json.dump({'clauses': clauses}, fw)
+
+    def load(self, filename):
+        """
+        Clauses (pos, neg) saved to filename and not added yet, none if it does not exist
+        """
+        if not os.path.exists(filename):
+            return []
+        with open(filename) as fr:
+            clauses = json.load(fr)['clauses']
+        # clauses saved without their reason may hold for their run only, they are left out
+        return [(pos, neg) for pos, neg, reason in (c for c in clauses if len(c) == 3)
+                if self.add_clause(pos, neg, f'{reason}, learned by an earlier run'
+                                   if reason else 'learned by an earlier run')]
+
+    def state(self):
+        """
+        Visited candidates, solutions and clauses with their reasons and whether they are local,
+        as JSON lists
+        """
+        return {
+            'visited': sorted(self.visited),
+            'solutions': sorted(self.solutions),
+            'clauses': [[sorted(self.decode(pos)), sorted(self.decode(neg)), self.reasons.get((pos, neg)),
+                         (pos, neg) in self.local]
+                        for pos, neg in sorted(self.clauses)],
+            'duplicates': self.duplicates,
+        }
+
+    def restore(self, state):
+        """
+        Add a state saved by state, return its clauses (pos, neg) not added yet
+        """
+        self.visited |= set(state['visited'])
+        self.solutions |= set(state['solutions'])
+        self.duplicates += state['duplicates']
+        return [(pos, neg) for pos, neg, reason, local in state['clauses']
+                if self.add_clause(pos, neg, reason, local)]
+
+    def stats(self):
+        return f'visited: {len(self.visited)}, solutions: {len(self.solutions)}, ' \
+            f'clauses: {len(self.clauses)}, duplicates: {self.duplicates}'
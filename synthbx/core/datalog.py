@@ -0,0 +1,495 @@
+import copy
+import os
+
+from synthbx.ast.type import NumberType, SubType, EquiType
+from synthbx.ast.atom import Atom
+from synthbx.ast.negation import Negation
+from synthbx.ast.constraint import Constraint
+from synthbx.ast.constant import Constant
+from synthbx.ast.variable import Variable
+from synthbx.ast.cmp import Cmp
+from synthbx.parser.program.parser import parse_program
+from synthbx.core.evaluator import load_relation
+
+
+# flow:
+#   Datalog(program)
+#   +-- stratify: strongly connected components of the dependency graph
+#   +-- evaluate(rule_set): semi-naive fixpoint per stratum
+#        +--- Evaluation.explain: proof tree in the JSON format of Souffle
+
+
+def is_number_type(t):
+    if t == NumberType():
+        return True
+    if type(t) is SubType:
+        return t.base == NumberType()
+    if type(t) is EquiType:
+        return t.alias == NumberType()
+    return False
+
+
+def const_value(c):
+    """
+    Value of a constant as it is read from a facts file: symbols are unquoted
+    """
+    v = c.value if isinstance(c, Constant) else c
+    if type(v) is str and len(v) > 1 and v.startswith('"') and v.endswith('"'):
+        return v[1:-1]
+    return str(v)
+
+
+def term(arg):
+    """
+    (True, name) for a variable, (True, None) for an anonymous variable,
+    (False, value) for a constant
+    """
+    if isinstance(arg, Variable):
+        return (True, None) if arg.is_anonymous() else (True, arg.name)
+    return (False, const_value(arg))
+
+
+def compare(cmp, x, y):
+    if cmp == Cmp.EQ:
+        return x == y
+    if cmp == Cmp.NE:
+        return x != y
+
+    try:
+        x, y = int(x), int(y)
+    except ValueError:
+        pass
+
+    if cmp == Cmp.LT:
+        return x < y
+    if cmp == Cmp.GT:
+        return x > y
+    if cmp == Cmp.LE:
+        return x <= y
+    return x >= y
+
+
+def match(args, t, binding):
+    new = binding
+    for (is_var, v), x in zip(args, t):
+        if not is_var:
+            if v != x:
+                return None
+        elif v is not None:
+            if v in new:
+                if new[v] != x:
+                    return None
+            else:
+                if new is binding:
+                    new = dict(binding)
+                new[v] = x
+    return new
+
+
+class Clause(object):
+    """
+    One conjunction of a rule, in the form used by the evaluator
+    """
+
+    def __init__(self, number, head, conj):
+        self.number = number
+        self.head = (head.name, [term(a) for a in head.args])
+        self.atoms = [(l.name, [term(a) for a in l.args])
+                      for l in conj.items if type(l) is Atom]
+        self.negations = [(l.atom.name, [term(a) for a in l.atom.args])
+                          for l in conj.items if type(l) is Negation]
+
+        # equalities bind their variable upfront, other comparisons are checked once bound
+        self.binding = {}
+        self.checks = []
+        for c in conj.items:
+            if type(c) is not Constraint:
+                continue
+            v = c.var.name
+            value = const_value(c.const)
+            if c.cmp == Cmp.EQ:
+                if self.binding.get(v, value) != value:
+                    self.binding = None
+                    break
+                self.binding[v] = value
+            else:
+                self.checks.append((c.cmp, v, value))
+
+    def body_names(self):
+        return {name for name, _ in self.atoms}
+
+    def negation_names(self):
+        return {name for name, _ in self.negations}
+
+
+class Datalog(object):
+    """
+    In-process evaluator of a candidate program, with why-provenance
+    """
+
+    def __init__(self, program, fact_dir=None):
+        self.types = {rd.name: rd.schema for rd in program.relation_decls}
+        self.inputs = [d.name for d in program.directives if d.is_input()]
+
+        self.clauses = []
+        for rule in program.rules:
+            for conj in rule.body:
+                self.clauses.append(Clause(len(self.clauses), rule.head, conj))
+
+        self.edb = {}
+        for name in self.inputs:
+            path = f'{fact_dir}/{name}.facts'
+            if name != 'Rule' and fact_dir is not None and os.path.exists(path):
+                self.edb[name] = load_relation(path)
+        for fact in program.facts:
+            self.edb.setdefault(fact.atom.name, set()).add(
+                tuple(const_value(a) for a in fact.atom.args)
+            )
+
+        self.strata = self.stratify()
+        self.plans = {}
+
+    def stratify(self):
+        """
+        Strongly connected components of the dependency graph, dependencies first
+        """
+        heads = {c.head[0] for c in self.clauses}
+        edges = {h: set() for h in heads}
+        for c in self.clauses:
+            edges[c.head[0]] |= (c.body_names() | c.negation_names()) & heads
+
+        index, low, stack, on_stack, sccs = {}, {}, [], set(), []
+
+        def connect(v):
+            index[v] = low[v] = len(index)
+            stack.append(v)
+            on_stack.add(v)
+            for w in edges[v]:
+                if w not in index:
+                    connect(w)
+                    low[v] = min(low[v], low[w])
+                elif w in on_stack:
+                    low[v] = min(low[v], index[w])
+            if low[v] == index[v]:
+                scc = set()
+                while True:
+                    w = stack.pop()
+                    on_stack.remove(w)
+                    scc.add(w)
+                    if w == v:
+                        break
+                sccs.append(scc)
+
+        for v in sorted(heads):
+            if v not in index:
+                connect(v)
+
+        strata = []
+        for scc in sccs:
+            clauses = [c for c in self.clauses if c.head[0] in scc]
+            for c in clauses:
+                if c.negation_names() & scc:
+                    raise ValueError(
+                        f'Program is not stratifiable: negation in recursion of {sorted(scc)}'
+                    )
+            strata.append((scc, clauses))
+        return strata
+
+    def evaluate(self, rule_set, provenance=False):
+        db = {name: set(ts) for name, ts in self.edb.items()}
+        db['Rule'] = {(str(r),) for r in rule_set}
+        support = {} if provenance else None
+
+        for scc, clauses in self.strata:
+            for name in scc:
+                db.setdefault(name, set())
+            self.evaluate_stratum(scc, clauses, db, support)
+
+        return Evaluation(self, db, support)
+
+    def coprovenance(self, rule_set, targets):
+        """
+        Rules of rule_set taking part in some derivation of each target (name, t), negations ignored,
+        targets without derivation left out. A subset of rule_set produces a target only by a derivation
+        using these rules
+        """
+        # without negations, every derivation under a subset of rule_set is a derivation here
+        relaxed = copy.copy(self)
+        relaxed.clauses = []
+        for c in self.clauses:
+            c = copy.copy(c)
+            c.negations = []
+            relaxed.clauses.append(c)
+        relaxed.strata = [(scc, [relaxed.clauses[c.number] for c in clauses])
+                          for scc, clauses in self.strata]
+        db = relaxed.evaluate(rule_set).relations
+
+        # every body match over the evaluated relations is an edge of the derivation graph
+        edges = {}
+        indexes = {}
+        for c in relaxed.clauses:
+            if c.binding is None:
+                continue
+            for t, body, _ in relaxed.join(c, None, db, {}, indexes, True):
+                rules = {x[0] for name, x in body if name == 'Rule'}
+                premises = [(name, x) for name, x in body if name != 'Rule']
+                edges.setdefault((c.head[0], t), []).append((rules, premises))
+
+        ans = {}
+        for target in targets:
+            if target[1] not in db.get(target[0], ()):
+                continue
+            rules = set()
+            seen = {target}
+            stack = [target]
+            while stack:
+                for used, premises in edges.get(stack.pop(), ()):
+                    rules |= used
+                    for premise in premises:
+                        if premise not in seen:
+                            seen.add(premise)
+                            stack.append(premise)
+            ans[target] = rules
+        return ans
+
+    def evaluate_stratum(self, scc, clauses, db, support):
+        recursive = [c for c in clauses if c.body_names() & scc]
+
+        # first round fires every clause on the full relations
+        delta = self.fire_round([(c, None) for c in clauses], db, {}, support)
+
+        while delta:
+            firings = [(c, i) for c in recursive
+                       for i, (name, _) in enumerate(c.atoms) if name in delta]
+            delta = self.fire_round(firings, db, delta, support)
+
+    def fire_round(self, firings, db, delta, support):
+        new = {}
+        indexes = {}
+
+        for clause, delta_pos in firings:
+            if clause.binding is None:
+                continue
+            name = clause.head[0]
+            for t, body, negs in self.join(clause, delta_pos, db, delta, indexes, support is not None):
+                if t in db[name] or t in new.get(name, ()):
+                    continue
+                new.setdefault(name, set()).add(t)
+                if support is not None:
+                    support[(name, t)] = (clause, body, negs)
+
+        for name, ts in new.items():
+            db[name] |= ts
+        return new
+
+    def plan(self, clause, delta_pos):
+        """
+        Order of body atoms with the positions bound when each is joined:
+        the delta atom first, then ground atoms such as Rule(n), then the rest
+        """
+        key = (clause.number, delta_pos)
+        if key in self.plans:
+            return self.plans[key]
+
+        order = list(range(len(clause.atoms)))
+        order.sort(key=lambda i: (i != delta_pos,
+                                  any(is_var for is_var, _ in clause.atoms[i][1]),
+                                  i))
+
+        # comparisons on variables bound upfront are checked before joining
+        bound = set(clause.binding)
+        unchecked = [c for c in clause.checks if c[1] not in bound]
+        plan = []
+
+        for i in order:
+            args = clause.atoms[i][1]
+            positions = tuple(p for p, (is_var, v) in enumerate(args)
+                              if not is_var or v in bound)
+            bound |= {v for is_var, v in args if is_var and v is not None}
+            checks = [c for c in unchecked if c[1] in bound]
+            unchecked = [c for c in unchecked if c[1] not in bound]
+            plan.append((i, positions, checks))
+
+        # comparisons on variables never bound make the clause unsatisfiable
+        self.plans[key] = (plan, not unchecked)
+        return self.plans[key]
+
+    def index(self, indexes, source, name, ts, positions):
+        key = (source, name, positions)
+        if key not in indexes:
+            idx = {}
+            for t in ts:
+                idx.setdefault(tuple(t[p] for p in positions), []).append(t)
+            indexes[key] = idx
+        return indexes[key]
+
+    def join(self, clause, delta_pos, db, delta, indexes, provenance):
+        plan, satisfiable = self.plan(clause, delta_pos)
+        if not satisfiable:
+            return
+
+        for cmp, v, value in clause.checks:
+            if v in clause.binding and not compare(cmp, clause.binding[v], value):
+                return
+
+        stack = [(0, clause.binding, ())]
+        while stack:
+            k, binding, facts = stack.pop()
+
+            if k == len(plan):
+                result = self.conclude(clause, binding, db, indexes, provenance)
+                if result is not None:
+                    t, negs = result
+                    body = None
+                    if provenance:
+                        body = [f for _, f in sorted(facts)]
+                    yield t, body, negs
+                continue
+
+            i, positions, checks = plan[k]
+            name, args = clause.atoms[i]
+
+            if i == delta_pos:
+                source, ts = 'delta', delta.get(name, set())
+            else:
+                source, ts = 'full', db.get(name, set())
+
+            if positions:
+                key = tuple(args[p][1] if not args[p][0] else binding[args[p][1]]
+                            for p in positions)
+                candidates = self.index(indexes, source, name, ts, positions).get(key, ())
+            else:
+                candidates = ts
+
+            for t in candidates:
+                b = match(args, t, binding)
+                if b is None:
+                    continue
+                if not all(compare(cmp, b[v], value) for cmp, v, value in checks):
+                    continue
+                stack.append(
+                    (k + 1, b, facts + ((i, (name, t)),) if provenance else facts)
+                )
+
+    def conclude(self, clause, binding, db, indexes, provenance):
+        negs = [] if provenance else None
+
+        for name, args in clause.negations:
+            positions = tuple(p for p, (is_var, v) in enumerate(args)
+                              if not is_var or v is not None)
+            key = tuple(binding[v] if is_var else v
+                        for is_var, v in (args[p] for p in positions))
+            if key in self.index(indexes, 'full', name, db.get(name, set()), positions):
+                return None
+            if provenance:
+                negs.append('!' + self.tuple_string(
+                    name, [(binding[v] if v is not None else None) if is_var else v
+                           for is_var, v in args]
+                ))
+
+        name, args = clause.head
+        if any(is_var and v not in binding for is_var, v in args):
+            return None
+        t = tuple(binding[v] if is_var else v for is_var, v in args)
+        return t, negs
+
+    def tuple_string(self, name, t):
+        schema = self.types.get(name, [])
+        xs = []
+        for p, x in enumerate(t):
+            if x is None:
+                xs.append('_')
+            elif p < len(schema) and is_number_type(schema[p]):
+                xs.append(str(x))
+            else:
+                xs.append(f'"{x}"')
+        return f'{name}({", ".join(xs)})'
+
+
+class Evaluation(object):
+    """
+    Relations computed for one rule set, with the first derivation of every tuple
+    """
+
+    def __init__(self, datalog, relations, support):
+        self.datalog = datalog
+        self.relations = relations
+        self.support = support
+
+    def explain(self, name, t):
+        """
+        Proof tree of name(t) in the JSON format of the explain command of Souffle
+        """
+        t = tuple(t)
+        if t not in self.relations.get(name, set()):
+            return {'proof': {'axiom': 'Tuple not found'}}
+
+        root = {}
+        stack = [(name, t, root)]
+        while stack:
+            r, x, node = stack.pop()
+            derivation = self.support.get((r, x))
+            if derivation is None:
+                node['axiom'] = self.datalog.tuple_string(r, x)
+                continue
+
+            clause, body, negs = derivation
+            node['premises'] = self.datalog.tuple_string(r, x)
+            node['rule-number'] = f'(R{clause.number + 1})'
+            node['children'] = []
+            for br, bt in body:
+                child = {}
+                node['children'].append(child)
+                stack.append((br, bt, child))
+            node['children'] += [{'axiom': n} for n in negs]
+
+        return {'proof': root}
+
+
+class DatalogBackend(object):
+    """
+    Evaluate the candidate program in-process, without subprocess nor file overhead
+    """
+
+    def __init__(self, problem_dir, program_file, relations):
+        with open(program_file, 'r') as fr:
+            program = parse_program(fr.read())
+        self.datalog = Datalog(program, problem_dir)
+        self.relations = list(relations)
+
+    def isolate(self, work_dir):
+        # facts are already in memory, nothing is shared on disk
+        return self
+
+    def outputs(self, evaluation):
+        return {rel: set(evaluation.relations.get(rel, set()))
+                for rel in self.relations}
+
+    def evaluate(self, rule_set):
+        return self.outputs(self.datalog.evaluate(rule_set))
+
+    def session(self, rule_set):
+        return DatalogSession(self, rule_set)
+
+
+class DatalogSession(object):
+    def __init__(self, backend, rule_set):
+        self.backend = backend
+        self.rule_set = rule_set
+        self.evaluation = None
+        self.outputs = None
+
+    def __enter__(self):
+        self.evaluation = self.backend.datalog.evaluate(
+            self.rule_set, provenance=True)
+        self.outputs = self.backend.outputs(self.evaluation)
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def explain(self, rel_name, t):
+        return self.evaluation.explain(rel_name, t)
+
+    def explain_all(self, queries):
+        return [self.evaluation.explain(rel_name, t) for rel_name, t in queries]
@@ -0,0 +1,495 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from synthbx.env.const import ESynth
+
+
+SOUFFLE_COMPILE = f'{os.path.dirname(ESynth.SOUFFLE_EXE)}/souffle-compile'
+
+# folder of compiled candidate programs, next to the problem folders of get and put
+BIN_FOLDER = '_bin'
+
+# output directory making souffle print output relations to stdout
+STDOUT = '-'
+
+
+class SouffleError(Exception):
+    """
+    Souffle failed or exited before answering
+    """
+
+
+def program_digest(program_file, provenance=True):
+    """
+    Content hash of a Souffle program together with the flags it is compiled with
+    """
+    h = hashlib.sha256()
+    with open(program_file, 'rb') as fr:
+        h.update(fr.read())
+    h.update(b'-t explain' if provenance else b'')
+    return h.hexdigest()
+
+
+def compile_program(program_file, bin_dir, provenance=True):
+    """
+    Compile program_file to a native executable cached in bin_dir by content hash.
+    Return the path of the executable, or None if the toolchain cannot build it
+    """
+    exe = f'{bin_dir}/{program_digest(program_file, provenance)}'
+
+    if os.path.exists(exe):
+        return exe
+
+    os.makedirs(bin_dir, exist_ok=True)
+
+    # souffle-compile names the executable after the .cpp file,
+    # build under a private name then publish it atomically
+    tmp_exe = f'{exe}.{os.getpid()}'
+    args = [ESynth.SOUFFLE_EXE, '-w', '-g', f'{tmp_exe}.cpp', program_file]
+    if provenance:
+        args[2:2] = ['-t', 'explain']
+
+    try:
+        subprocess.run(args, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        subprocess.run([SOUFFLE_COMPILE, f'{tmp_exe}.cpp'], check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        os.replace(tmp_exe, exe)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    finally:
+        if os.path.exists(f'{tmp_exe}.cpp'):
+            os.remove(f'{tmp_exe}.cpp')
+
+    return exe
+
+
+def souffle_args(problem_dir, program_file, exe=None, provenance=True, output_dir=None):
+    """
+    Command line evaluating program_file on the facts of problem_dir,
+    by the compiled executable exe if given, by the interpreter otherwise.
+    Outputs are written to output_dir, problem_dir by default
+    """
+    if output_dir is None:
+        output_dir = problem_dir
+
+    if exe is not None:
+        return [exe, '-F', problem_dir, '-D', output_dir]
+
+    args = [ESynth.SOUFFLE_EXE, '-w', '-F', problem_dir,
+            '-D', output_dir, program_file]
+    if provenance:
+        args[2:2] = ['-t', 'explain']
+    return args
+
+
+def load_relation(filename):
+    ans = {line.strip() for line in open(filename) if line.strip()}
+    ans = {tuple(line.split('\t')) for line in ans}
+    return ans
+
+
+def write_relation(filename, tuples):
+    with open(filename, 'w') as fw:
+        for t in sorted(tuples):
+            print('\t'.join(t), file=fw)
+
+
+def read_printed_relations(lines):
+    """
+    Relations printed by souffle -D -, by name: every relation is framed as
+    ---------------, its name, ===============, its tuples, ===============
+    """
+    relations = {}
+    lines = iter(lines)
+    for line in lines:
+        if line.strip() != '---------------':
+            continue
+        name = next(lines, '').strip()
+        next(lines, None)
+        ans = set()
+        for line in lines:
+            if line.strip() == '===============':
+                break
+            if line.strip():
+                ans.add(tuple(line.strip().split('\t')))
+        relations[name] = ans
+    return relations
+
+
+def evaluate_printed(args):
+    """
+    Run souffle by args, output directory set to STDOUT, and return its output relations by name
+    """
+    proc = subprocess.run(args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                          universal_newlines=True)
+    if proc.returncode != 0:
+        raise SouffleError(f'souffle exited with code {proc.returncode}: {" ".join(args)}')
+    return read_printed_relations(proc.stdout.splitlines())
+
+
+def evaluate_outputs(problem_dir, program_file, io='files'):
+    """
+    Evaluate program_file on the facts of problem_dir without provenance, return its output relations
+    by name, read from the CSV files written to problem_dir and removed (io 'files') or from its stdout
+    """
+    if io == 'memory':
+        return evaluate_printed(
+            souffle_args(problem_dir, program_file, provenance=False, output_dir=STDOUT))
+
+    args = souffle_args(problem_dir, program_file, provenance=False)
+    proc = subprocess.run(args, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+    if proc.returncode != 0:
+        raise SouffleError(f'souffle exited with code {proc.returncode}: {" ".join(args)}')
+
+    outputs = {}
+    for f in sorted(os.listdir(problem_dir)):
+        if f.endswith('.csv'):
+            outputs[f[:-len('.csv')]] = load_relation(f'{problem_dir}/{f}')
+            os.remove(f'{problem_dir}/{f}')
+    return outputs
+
+
+def souffle_string(rel_name, t):
+    t = tuple('"{}"'.format(x) for x in t)
+    t = ', '.join(t)
+    return '{}({})'.format(rel_name, t)
+
+
+def parse_souffle_string(string):
+    xs = string.split('(')
+    assert(len(xs) == 2)
+    rel_name = xs[0].strip()
+    xs = xs[1]
+    xs = xs.split(')')[0].strip()
+    xs = [x.strip() for x in xs.split(',')]
+    xs = tuple([x[1:-1].strip() for x in xs])
+    return (rel_name, xs)
+
+
+# a string is a key when a colon follows it, spaces in between
+JSON_TOKEN = re.compile(r'[{}\[\]]|"(?:[^"\\]|\\.)*"(?:\s*:)?|[^\s,:{}\[\]]+')
+
+
+def text_tokens(text):
+    """
+    Tokens of a JSON document read left to right: brackets, ('key', k) and ('value', v)
+    """
+    for m in JSON_TOKEN.finditer(text):
+        token = m.group()
+        if token in ('{', '}', '[', ']'):
+            yield token
+        elif token[-1] == ':':
+            yield ('key', json.loads(token[:-1].rstrip()))
+        elif token[0] == '"':
+            yield ('value', json.loads(token) if '\\' in token else token[1:-1])
+        else:
+            yield ('value', token)
+
+
+def tree_tokens(tree):
+    """
+    Tokens of a decoded JSON document, as text_tokens would read them
+    """
+    stack = [(iter([tree]), None)]
+    while stack:
+        items, close = stack[-1]
+        node = next(items, stack)
+        if node is stack:
+            stack.pop()
+            if close is not None:
+                yield close
+            continue
+        if close == '}':
+            key, node = node
+            yield ('key', key)
+        if type(node) is dict:
+            yield '{'
+            stack.append((iter(node.items()), '}'))
+        elif type(node) is list:
+            yield '['
+            stack.append((iter(node), ']'))
+        else:
+            yield ('value', node)
+
+
+def proof_rules(proof, pruned):
+    """
+    Rules used by the proof tree of an explain reply, given as JSON text or decoded,
+    in one iterative pass: subproofs of premises (rel_name, t) for which pruned holds are skipped.
+    Return None if the reply has no proof tree
+    """
+    tokens = text_tokens(proof) if type(proof) is str else tree_tokens(proof)
+
+    # frame of every open object or list: rules used so far, whether it is pruned, current key;
+    # the reply is {"proof": {"premises": .., "children": [..]}}, its own premises are never pruned
+    stack = [[set(), False, None]]
+    proved = False
+    for token in tokens:
+        if type(token) is tuple:
+            kind, value = token
+            frame = stack[-1]
+            if kind == 'key':
+                frame[2] = value
+                if value == 'children' and len(stack) == 3 and stack[1][2] == 'proof':
+                    proved = True
+            elif frame[2] == 'axiom' and value.startswith('Rule'):
+                frame[0].add(value[len('Rule') + 1:-1])
+            elif frame[2] == 'premises' and len(stack) > 3 and pruned(*parse_souffle_string(value)):
+                frame[1] = True
+        elif token in ('{', '['):
+            stack.append([set(), False, None])
+        else:
+            rules, skip, _ = stack.pop()
+            if not skip:
+                stack[-1][0] |= rules
+
+    if not proved:
+        return None
+    return stack[0][0]
+
+
+class SouffleBackend(object):
+    """
+    Evaluate the candidate program by Souffle, selecting rules through Rule.facts.
+    Output relations are read from CSV files (io 'files') or from the stdout of souffle (io 'memory')
+    """
+
+    def __init__(self, problem_dir, program_file, relations, exe=None, plain_exe=None, queue_depth=1,
+                 io='files'):
+        self.problem_dir = problem_dir
+        self.program_file = program_file
+        self.relations = list(relations)
+        self.exe = exe
+        self.plain_exe = plain_exe
+        self.queue_depth = max(1, queue_depth)
+        self.io = io
+        output_dir = STDOUT if io == 'memory' else None
+        # provenance is only paid for by sessions answering explain queries
+        self.cmd_args = souffle_args(
+            problem_dir, program_file, exe, output_dir=output_dir)
+        self.plain_args = souffle_args(
+            problem_dir, program_file, plain_exe, provenance=False, output_dir=output_dir)
+
+    def isolate(self, work_dir):
+        """
+        Copy of this backend evaluating in work_dir, which links to the facts of problem_dir
+        """
+        for f in os.listdir(self.problem_dir):
+            if f.endswith('.facts') and f != 'Rule.facts':
+                src = os.path.abspath(f'{self.problem_dir}/{f}')
+                try:
+                    os.link(src, f'{work_dir}/{f}')
+                except OSError:
+                    os.symlink(src, f'{work_dir}/{f}')
+        return SouffleBackend(work_dir, self.program_file, self.relations,
+                              self.exe, self.plain_exe, self.queue_depth, self.io)
+
+    def write_rules(self, rule_set):
+        with open(f'{self.problem_dir}/Rule.facts', 'w') as fw:
+            for name in rule_set:
+                print(name, file=fw)
+
+    def clear_outputs(self):
+        for rel in self.relations:
+            if os.path.exists(f'{self.problem_dir}/{rel}.csv'):
+                os.remove(f'{self.problem_dir}/{rel}.csv')
+
+    def load_outputs(self, printed=None):
+        if self.io == 'memory':
+            return {rel: printed.get(rel, set()) for rel in self.relations}
+        return {rel: load_relation(f'{self.problem_dir}/{rel}.csv')
+                for rel in self.relations}
+
+    def evaluate(self, rule_set):
+        self.write_rules(rule_set)
+        if self.io == 'memory':
+            return self.load_outputs(evaluate_printed(self.plain_args))
+        # outputs of an earlier evaluation must not be read as those of a failed one
+        self.clear_outputs()
+        proc = subprocess.run(self.plain_args, stdin=subprocess.DEVNULL,
+                              stdout=subprocess.DEVNULL)
+        if proc.returncode != 0:
+            raise SouffleError(f'souffle exited with code {proc.returncode}: {" ".join(self.plain_args)}')
+        return self.load_outputs()
+
+    def session(self, rule_set):
+        return SouffleSession(self, rule_set, self.queue_depth)
+
+
+class SouffleSession(object):
+    """
+    Souffle process kept alive in explain mode, answering provenance queries
+    """
+
+    def __init__(self, backend, rule_set, queue_depth=1):
+        self.backend = backend
+        self.rule_set = rule_set
+        self.queue_depth = queue_depth
+        self.proc = None
+        self.outputs = None
+
+    def __enter__(self):
+        self.backend.write_rules(self.rule_set)
+        if self.backend.io == 'files':
+            self.backend.clear_outputs()
+
+        self.proc = subprocess.Popen(
+            args=self.backend.cmd_args,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            universal_newlines=True)
+
+        # output relations printed to stdout come before the prompts of explain
+        printed = []
+        for _ in range(2):
+            line = self.proc.stdout.readline()
+            while line.strip() != '###':
+                if line == '':
+                    # souffle exited before its prompt
+                    self.proc.stdin.close()
+                    self.proc.stdout.close()
+                    raise SouffleError(f'souffle exited with code {self.proc.wait()} '
+                                       f'before answering: {" ".join(self.backend.cmd_args)}')
+                printed.append(line)
+                line = self.proc.stdout.readline()
+
+        self.execute('format json')
+        self.execute('setdepth 200000')
+
+        self.outputs = self.backend.load_outputs(read_printed_relations(printed))
+        return self
+
+    def __exit__(self, *exc):
+        # processes forked while the session is open hold the write end of its stdin too,
+        # souffle is told to exit instead of waiting for an end of file that never comes
+        self.send('exit')
+        try:
+            self.proc.stdin.close()
+        except OSError:
+            pass
+        return self.proc.__exit__(*exc)
+
+    def send(self, cmd):
+        try:
+            print(cmd, file=self.proc.stdin)
+            self.proc.stdin.flush()
+        except OSError:
+            # the reply is read as an error once souffle has exited
+            pass
+
+    def receive(self):
+        response = [self.proc.stdout.readline()]
+        while response[-1].strip() != '###':
+            if response[-1] == '':
+                # doesn't deal with underlying problem, just passes error through and skips question
+                return "error reading"
+            response.append(self.proc.stdout.readline())
+        response = response[:-1]
+        return '\n'.join([line.strip() for line in response])
+
+    def execute(self, cmd):
+        self.send(cmd)
+        return self.receive()
+
+    def explain(self, rel_name, t):
+        return self.explain_all([(rel_name, t)])[0]
+
+    def explain_all(self, queries):
+        """
+        Pipeline explain queries, keeping at most queue_depth of them in flight;
+        replies are correlated with queries by order and left as JSON text
+        """
+        queries = list(queries)
+        responses = []
+        sent = 0
+
+        while len(responses) < len(queries):
+            while sent < len(queries) and sent - len(responses) < self.queue_depth:
+                self.send('explain ' + souffle_string(*queries[sent]))
+                sent += 1
+            responses.append(self.receive())
+
+        return responses
+
+
+class TieredSession(object):
+    """
+    Session answering outputs from a plain evaluation,
+    starting a provenance session of backend only when a proof tree is asked for
+    """
+
+    def __init__(self, backend, rule_set, outputs, on_open=None):
+        self.backend = backend
+        self.rule_set = rule_set
+        self.outputs = outputs
+        self.on_open = on_open
+        self.session = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if self.session is not None:
+            return self.session.__exit__(*exc)
+        return False
+
+    def open(self):
+        if self.session is None:
+            self.session = self.backend.session(self.rule_set).__enter__()
+            if self.on_open is not None:
+                self.on_open()
+        return self.session
+
+    def explain(self, rel_name, t):
+        return self.open().explain(rel_name, t)
+
+    def explain_all(self, queries):
+        queries = list(queries)
+        if not queries:
+            return []
+        return self.open().explain_all(queries)
+
+
+worker_backend = None
+
+
+def init_worker(backend, scratch_dir):
+    global worker_backend
+    worker_backend = backend.isolate(tempfile.mkdtemp(dir=scratch_dir))
+
+
+def evaluate_in_worker(rule_set):
+    return worker_backend.evaluate(rule_set)
+
+
+class EvaluationPool(object):
+    """
+    Process pool evaluating rule sets concurrently,
+    every worker owns a scratch folder so that Rule.facts and outputs never clash
+    """
+
+    def __init__(self, backend, jobs, scratch_root):
+        self.jobs = jobs
+        self.scratch_dir = tempfile.mkdtemp(prefix='scratch', dir=scratch_root)
+        self.executor = ProcessPoolExecutor(
+            max_workers=jobs,
+            initializer=init_worker,
+            initargs=(backend, self.scratch_dir)
+        )
+        # workers are forked at the first submission, before any session is open,
+        # so that none of them inherits the pipes of a souffle process
+        self.executor.submit(os.getpid).result()
+
+    def map(self, rule_sets):
+        return list(self.executor.map(evaluate_in_worker, rule_sets))
+
+    def close(self):
+        self.executor.shutdown()
+        shutil.rmtree(self.scratch_dir, ignore_errors=True)
@@ -0,0 +1,49 @@
+from synthbx.core.materialize import dependency_cones
+
+
+# Checks before any candidate is evaluated. When the candidate program is monotone in the enabled
+# rules (no negation of a relation derived by a selected clause), a rule producing an undesired
+# tuple on its own produces it in every candidate enabling it, and is never part of a solution.
+
+
+def is_monotone(datalog):
+    _, relation_cones = dependency_cones(datalog)
+    for c in datalog.clauses:
+        for name in c.negation_names():
+            if relation_cones.get(name, frozenset()) != frozenset():
+                return False
+    return True
+
+
+def doomed_rules(datalog, rule_names, expected):
+    """
+    Rules producing, enabled alone, a tuple of an expected relation that is not expected,
+    by rule with such a tuple (name, t); none unless datalog is monotone
+    """
+    if not is_monotone(datalog):
+        return {}
+
+    ans = {}
+    for rule_name in sorted(rule_names):
+        relations = datalog.evaluate({rule_name}).relations
+        for name in sorted(expected):
+            undesired = relations.get(name, set()) - expected[name]
+            if undesired:
+                ans[rule_name] = (name, min(undesired))
+                break
+    return ans
+
+
+def infeasible_tuples(datalog, rule_names, expected, doomed):
+    """
+    Expected tuples (name, t) no candidate without the doomed rules produces,
+    each with the doomed rules of its derivations when every rule is enabled
+    """
+    targets = [(name, t) for name in sorted(expected) for t in sorted(expected[name])]
+    derivable = datalog.coprovenance(set(rule_names) - doomed.keys(), targets)
+    missing = [target for target in targets if target not in derivable]
+    if not missing:
+        return []
+
+    blocked = datalog.coprovenance(set(rule_names), missing) if doomed else {}
+    return [(target, sorted(blocked.get(target, set()) & doomed.keys())) for target in missing]
@@ -0,0 +1,37 @@
+from synthbx.core.materialize import selectors
+
+
+# prefix of the relations invented by candidate generation (eg. inv in the popl-20 benchmarks)
+INVENTED_PREFIX = 'inv'
+
+
+def rule_features(clause):
+    """
+    Body literals, constants and literals of invented relations of a clause, Rule literals excluded
+    """
+    literals = [(name, args) for name, args in clause.atoms + clause.negations
+                if name != 'Rule']
+    constants = sum(1 for _, args in literals for is_var, _ in args if not is_var)
+    if clause.binding:
+        constants += len(clause.binding)
+    return {
+        'body': len(literals) + len(clause.checks) + len(clause.binding or {}),
+        'constants': constants,
+        'invented': sum(1 for name, _ in literals if name.startswith(INVENTED_PREFIX)),
+    }
+
+
+def rule_weights(datalog, rule_names):
+    """
+    Cost of enabling each rule: 1 plus the features of the clauses it selects,
+    so that cheap candidate sets are small sets of simple rules
+    """
+    weights = {name: 1 for name in rule_names}
+    for c in datalog.clauses:
+        names = selectors(c)
+        if not names:
+            continue
+        cost = sum(rule_features(c).values())
+        for name in names & weights.keys():
+            weights[name] += cost
+    return weights
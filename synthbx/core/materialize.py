@@ -0,0 +1,152 @@
+from synthbx.core.datalog import Datalog
+from synthbx.parser.program.parser import parse_program
+
+
+# Outputs of a non-recursive candidate program for a rule set are the union, relation by relation,
+# of the outputs of its enabled rules. The output of a rule only depends on the enabled rules
+# of its dependency cone (rules defining the relations of its body, transitively), so it is
+# computed once per distinct cone selection: once and for all for rules reading only inputs.
+
+
+def selectors(clause):
+    """
+    Rule names selecting clause, None if a Rule literal is not ground
+    """
+    names = set()
+    for name, args in clause.atoms:
+        if name == 'Rule':
+            if any(is_var for is_var, _ in args):
+                return None
+            names.add(args[0][1])
+    for name, _ in clause.negations:
+        if name == 'Rule':
+            return None
+    return frozenset(names)
+
+
+def dependency_cones(datalog):
+    """
+    Rules the clauses and the derived relations of datalog depend on, by clause number and by name,
+    None when a Rule literal is not ground. The cone of a clause only covers earlier strata
+    """
+    clause_cones = {}
+    relation_cones = {}
+    for scc, clauses in datalog.strata:
+        for c in clauses:
+            cone = set()
+            for name in c.body_names() | c.negation_names():
+                dep = relation_cones.get(name, frozenset())
+                if dep is None:
+                    cone = None
+                    break
+                cone |= dep
+            clause_cones[c.number] = None if cone is None else frozenset(cone)
+
+        cone = set()
+        for c in clauses:
+            if selectors(c) is None or clause_cones[c.number] is None:
+                cone = None
+                break
+            cone |= selectors(c) | clause_cones[c.number]
+        for name in scc:
+            relation_cones[name] = None if cone is None else frozenset(cone)
+
+    return clause_cones, relation_cones
+
+
+def parse_datalog(problem_dir, program_file):
+    with open(program_file, 'r') as fr:
+        return Datalog(parse_program(fr.read()), problem_dir)
+
+
+def try_parse_datalog(problem_dir, program_file):
+    """
+    The candidate program as parse_datalog reads it, None if it uses syntax the parser does not know
+    (eg. aggregates) though Souffle evaluates it
+    """
+    try:
+        return parse_datalog(problem_dir, program_file)
+    except (Exception, SystemExit):
+        # the parser exits on a syntax error
+        return None
+
+
+def is_materializable(datalog):
+    for scc, clauses in datalog.strata:
+        if len(scc) > 1:
+            return False
+        for c in clauses:
+            if c.body_names() & scc or selectors(c) is None:
+                return False
+    return True
+
+
+class MaterializedBackend(object):
+    """
+    Answer the outputs of a rule set by union of per-rule outputs, evaluated in-process once;
+    provenance sessions are left to the underlying backend
+    """
+
+    def __init__(self, base, datalog):
+        self.base = base
+        self.datalog = datalog
+        self.relations = base.relations
+
+        self.selectors = {c.number: selectors(c) for c in datalog.clauses}
+        self.cones, _ = dependency_cones(datalog)
+
+        self.memo = {}
+
+    def output(self, clause, rule_set, db):
+        key = (clause.number, rule_set & self.cones[clause.number])
+        if key not in self.memo:
+            view = dict(db)
+            view['Rule'] = {(r,) for r in self.selectors[clause.number]}
+            self.memo[key] = {
+                t for t, _, _ in self.datalog.join(clause, None, view, {}, {}, False)
+            }
+        return self.memo[key]
+
+    def attribute(self, rule_set):
+        """
+        Tuples of every derived relation, each with the enabled rules producing it
+        """
+        rule_set = frozenset(str(r) for r in rule_set)
+        db = dict(self.datalog.edb)
+        attribution = {}
+
+        for scc, clauses in self.datalog.strata:
+            produced = {}
+            for c in clauses:
+                if c.binding is None or not self.selectors[c.number] <= rule_set:
+                    continue
+                for t in self.output(c, rule_set, db):
+                    produced.setdefault(t, set()).update(self.selectors[c.number])
+            for name in scc:
+                db[name] = set(produced)
+                attribution[name] = produced
+
+        return attribution
+
+    def evaluate(self, rule_set):
+        attribution = self.attribute(rule_set)
+        return {rel: set(attribution.get(rel, {})) for rel in self.relations}
+
+    def isolate(self, work_dir):
+        return self
+
+    def session(self, rule_set):
+        return self.base.session(rule_set)
+
+
+def materialize(backend, problem_dir, program_file):
+    """
+    Wrap backend by per-rule materialization if the candidate program allows it
+    """
+    datalog = getattr(backend, 'datalog', None)
+    if datalog is None:
+        datalog = try_parse_datalog(problem_dir, program_file)
+
+    if datalog is None or not is_materializable(datalog):
+        return backend
+    return MaterializedBackend(backend, datalog)
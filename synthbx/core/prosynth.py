@@ -18,6 +18,11 @@
 
 # If synthesis is successful, then it prints to stdout one subset of rules with the desired input-output behavior
 
+# The search is a re-entrant engine, ProSynth(problem_dir, progr, options).run() returns a Result;
+# the synthesis of get runs the synthesis of put in-process for every get it finds,
+# or in background processes while it keeps searching gets (--put-jobs);
+# the search of get is checkpointed (--checkpoint) and continued by a later run (--resume)
+
 ########################################################################################################################
 
 
@@ -28,731 +33,1094 @@
 
 from synthbx.util.io import yprint, cprint
 from synthbx.env.const import ESynth, EFolder, EFile
-import shutil
+from synthbx.core.evaluator import BIN_FOLDER, compile_program, load_relation, proof_rules, SouffleBackend, SouffleError, EvaluationPool, TieredSession
+from synthbx.core.datalog import DatalogBackend
+from synthbx.core.cache import EvaluationCache, ProvenanceCache, problem_digest
+from synthbx.core.constraints import CHECKPOINT_FOLDER, CLAUSE_FOLDER, ConstraintStore
+from synthbx.core.solver import make_solver, unsat_core, SOLVERS
+from synthbx.core.features import rule_weights
+from synthbx.core.subsume import structural_clauses
+from synthbx.core.feasibility import doomed_rules, infeasible_tuples, is_monotone
+from synthbx.core.materialize import dependency_cones, materialize, try_parse_datalog, MaterializedBackend
 
 # 1. Prelude
 
+import argparse
 import json
 import logging
 import os
 import random
 import re
-import subprocess
 import sys
 import time
-import z3
 import copy
-import atexit
-
-prevConstraints, currConstraints = (-1, 0)
-numLoops = 0
-
-currRuleSetLarge = set()
-# currIgnoreSetLarge = set()
-numWhy = 0
-numWhyNot = 0
-
-problemDirName = sys.argv[1]
-setting_coprov = sys.argv[2]
-setting_delta = sys.argv[3]
-data_file = sys.argv[4]
-
-progr = sys.argv[5]
-
-scriptStartTime = time.clock_gettime(0)
-mark0 = [scriptStartTime, scriptStartTime]
-synthTime = [0, 0]
-
-souffle_exec = ESynth.SOUFFLE_EXE
-candidateProgFile = f'{problemDirName}/{ESynth.CANDIDATE_RULE_DL}'
-ruleNameFile = f'{problemDirName}/{ESynth.RULENAME_TXT}'
-
-cmd_args = [souffle_exec, '-w', '-t', 'explain', '-F', problemDirName,
-            '-D', problemDirName, candidateProgFile]
-
-n_get = 0
 
-cprint(f'[+] Synthesizing {progr[:-3]}')
 
+# outcomes of a search
+SOLVED = 'solved'
+EXHAUSTED = 'exhausted'
+UNSAT = 'unsat'
+INFEASIBLE = 'infeasible'
+TIMEOUT = 'timeout'
+
+
+def make_parser():
+    """
+    Options of a search, given after the positional arguments of the command line
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('-c', '--compile', action='store_true',
+                        help='compile the candidate program once and re-run the executable')
+    parser.add_argument('-b', '--backend', choices=['souffle', 'python'], default='souffle',
+                        help='evaluate candidate programs by Souffle or in-process')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of processes evaluating the chunks of delta debugging')
+    parser.add_argument('--eval-cache', type=int, default=1024,
+                        help='number of rule sets whose outputs are memoized, 0 to disable')
+    parser.add_argument('--materialize', action='store_true',
+                        help='evaluate every rule once and answer outputs by union (non-recursive programs)')
+    parser.add_argument('--tiered', action='store_true',
+                        help='check outputs without provenance, explain only when proof trees are needed')
+    parser.add_argument('--queue-depth', type=int, default=16,
+                        help='number of explain queries in flight to a provenance session')
+    parser.add_argument('--prov-cache', type=int, default=1024,
+                        help='number of explained tuples whose proof rules are memoized, 0 to disable')
+    parser.add_argument('--output-io', choices=['files', 'memory'], default='files',
+                        help='read output relations of Souffle from CSV files or from its stdout')
+    parser.add_argument('--solver', choices=['auto'] + sorted(SOLVERS), default='auto',
+                        help='solver selecting the candidate rules, auto is the built-in CDCL solver')
+    parser.add_argument('--optimize', action='store_true',
+                        help='select small sets of simple rules instead of enabling every unconstrained rule')
+    parser.add_argument('--why-budget', type=int, default=0,
+                        help='number of evaluations spent minimizing each why constraint, 0 to disable')
+    parser.add_argument('--subsume', action='store_true',
+                        help='exclude candidates enabling a rule along with a rule subsuming it, before any evaluation')
+    parser.add_argument('--coprov', action='store_true',
+                        help='constrain unproduced tuples by their co-provenance instead of delta debugging')
+    parser.add_argument('--whynot-proof', action='store_true',
+                        help='constrain an unproduced tuple by its proof with every rule enabled, '
+                             'delta debugging only if it has none')
+    parser.add_argument('--warm-start', action='store_true',
+                        help='reload the clauses learned by earlier runs on the same inputs and save them at exit')
+    parser.add_argument('--precheck', action='store_true',
+                        help='disable rules producing undesired tuples on their own and stop if an expected tuple '
+                             'is then underivable, before any evaluation')
+    parser.add_argument('--timeout', type=int, default=3600,
+                        help='seconds after which the search stops')
+    parser.add_argument('--put-jobs', type=int, default=1,
+                        help='number of processes synthesizing the put of found gets while the search of gets goes on, '
+                             '1 to synthesize put before searching further')
+    parser.add_argument('--checkpoint', type=int, default=0,
+                        help='seconds between checkpoints of the search of get, 0 to disable')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue the search of get from its last checkpoint on the same inputs')
+    return parser
+
+
+def parse_settings(options=()):
+    return make_parser().parse_args(list(options))
+
+
+class Counters(object):
+    """
+    Work done by a search: iterations, solver checks, evaluations and provenance sessions,
+    constraints learned, gets found and time spent synthesizing get and put
+    """
+
+    def __init__(self):
+        self.iterations = 0
+        self.z3 = 0
+        self.souffle = 0
+        self.why = 0
+        self.whynot = 0
+        self.constraints = 0
+        self.gets = 0
+        self.synth_time = [0, 0]
+
+
+class Result(object):
+    """
+    Outcome of a search: the enabled rules and the program written if solved,
+    the unsat core or the infeasible tuples otherwise
+    """
+
+    def __init__(self, status, counters, rules=None, program=None, reasons=()):
+        self.status = status
+        self.counters = counters
+        self.rules = rules
+        self.program = program
+        self.reasons = list(reasons)
+
+    def __bool__(self):
+        return self.status == SOLVED
+
+
+class ProSynth(object):
+    """
+    Synthesis of a subset of the candidate rules of problem_dir producing exactly the expected tuples,
+    written as progr next to problem_dir. Every run starts afresh from the files of problem_dir,
+    the solutions of one run are generated one at a time by results
+    """
+
+    def __init__(self, problem_dir, progr, options=(), setting_coprov='0', setting_delta='1',
+                 data_file='/dev/null'):
+        self.problem_dir = problem_dir
+        self.progr = progr
+        # options are forwarded to the synthesis of put
+        self.options = list(options)
+        self.settings = parse_settings(self.options)
+        self.setting_coprov = '1' if self.settings.coprov else setting_coprov
+        self.setting_delta = setting_delta
+        self.data_file = data_file
+
+        self.candidateProgFile = f'{problem_dir}/{ESynth.CANDIDATE_RULE_DL}'
+        self.ruleNameFile = f'{problem_dir}/{ESynth.RULENAME_TXT}'
+        self.counters = Counters()
+
+    def run(self):
+        results = self.results()
+        try:
+            return next(results)
+        finally:
+            results.close()
+
+    def results(self):
+        """
+        Generate the solutions one at a time, the search going on from the clauses learned so far,
+        then the result ending the search unless the generator is closed before
+        """
+        logging.basicConfig(
+            level=logging.INFO,
+            format=" %(levelname)s [%(name)s.%(funcName)s:%(lineno)d] %(message)s",
+            datefmt="%H:%M:%S"
+        )
 
-def printLog():
-    global callsToZ3
-    global callsToSouffle
-
-    with open(data_file, 'a+') as f:
-        dataLogStr = f"""{{name: '{problemDirName},
-	z3: {callsToZ3}, souffle: {callsToSouffle},
-	runtime: {time.clock_gettime(0) - scriptStartTime},
-	setting_delta: {setting_delta}}}"""
-        print(dataLogStr, file=f)
-
+        cprint(f'[+] Synthesizing {self.progr[:-3]}')
+        self.startTime = time.clock_gettime(0)
+        self.mark0 = [self.startTime, self.startTime]
+        self.counters = Counters()
 
-def printTimer():
-    cprint(f'[+] Exit Synthesizing {progr[:-3]}')
-    print(
-        f"SynthTime ({progr}): {synthTime}"
-    )
-    print(
-        f"Total runtime ({progr}): {str(time.clock_gettime(0) - scriptStartTime)}"
-    )
-    if progr == EFile.GET:
+        self.setup()
+        # status of the last result, None while the search goes on
+        self.status = None
+        search = self.search()
+        try:
+            for result in search:
+                self.status = result.status
+                yield result
+        finally:
+            search.close()
+            self.close()
+            self.printTimer()
+
+    def printLog(self):
+        with open(self.data_file, 'a+') as f:
+            dataLogStr = f"""{{name: '{self.problem_dir},
+	z3: {self.counters.z3}, souffle: {self.counters.souffle},
+	runtime: {time.clock_gettime(0) - self.startTime},
+	setting_delta: {self.setting_delta}}}"""
+            print(dataLogStr, file=f)
+
+    def printTimer(self):
+        progr = self.progr
+        cprint(f'[+] Exit Synthesizing {progr[:-3]}')
         print(
-            f"Number of found gets ({progr}):{n_get}"
+            f"SynthTime ({progr}): {self.counters.synth_time}"
+        )
+        print(
+            f"Total runtime ({progr}): {str(time.clock_gettime(0) - self.startTime)}"
+        )
+        if progr == EFile.GET:
+            print(
+                f"Number of found gets ({progr}):{self.counters.gets}"
+            )
+        print(
+            f"Evaluation cache ({progr}): {self.evalCache.stats()}"
+        )
+        print(
+            f"Provenance cache ({progr}): {self.provCache.stats()}"
+        )
+        print(
+            f"Constraint store ({progr}): {self.store.stats()}"
         )
 
+    ####################################################################################################################
+    # 1a. Load the set of rules and IDB relations
+
+    def setup(self):
+        args = self.settings
+        problemDirName = self.problem_dir
+        candidateProgFile = self.candidateProgFile
+        progr = self.progr
+
+        # only the search of get is checkpointed, the put of a get is synthesized afresh
+        self.checkpointFile = None
+        checkpoint = None
+        if progr == EFile.GET and (args.checkpoint > 0 or args.resume):
+            self.checkpointFile = f'{problemDirName}/../{CHECKPOINT_FOLDER}/{progr[:-3]}.json'
+            if args.resume:
+                checkpoint = self.readCheckpoint()
+
+        self.allRuleNames = {name.strip() for name in open(self.ruleNameFile) if name.strip()}
+        allRuleNames = self.allRuleNames
+
+        idbRelationsExpected = {name for name in os.listdir(
+            problemDirName) if name.endswith('.expected')}
+        idbRelationsExpected = {name[:-len('.expected')]
+                                for name in idbRelationsExpected}
+        self.idbRelationsExpected = {name: load_relation(
+            problemDirName + '/' + name + '.expected') for name in idbRelationsExpected}
+        idbRelationsExpected = self.idbRelationsExpected
+
+        self.outputSet = set()
+        with open(candidateProgFile, 'r') as fr:
+            for line in fr:
+                if re.search(r'\.output (\w+)', line.strip()):
+                    self.outputSet.add(line.strip()[len('.output '):])
+
+        self.outputSet |= idbRelationsExpected.keys()
+
+        # 1b. Set up the evaluation backend
+
+        if args.backend == 'python':
+            backend = DatalogBackend(
+                problemDirName, candidateProgFile, idbRelationsExpected.keys())
+        else:
+            # only Rule.facts changes between evaluations, the program is compiled once,
+            # with and without provenance
+            souffle_bin, souffle_plain_bin = None, None
+            if args.compile:
+                souffle_bin = compile_program(
+                    candidateProgFile, f'{problemDirName}/../{BIN_FOLDER}')
+                souffle_plain_bin = compile_program(
+                    candidateProgFile, f'{problemDirName}/../{BIN_FOLDER}', provenance=False)
+                if souffle_bin is None or souffle_plain_bin is None:
+                    yprint('Cannot compile candidate program, fall back to interpreter')
+
+            backend = SouffleBackend(
+                problemDirName, candidateProgFile, idbRelationsExpected.keys(),
+                souffle_bin, souffle_plain_bin, args.queue_depth, args.output_io)
+
+        if args.materialize:
+            backend = materialize(backend, problemDirName, candidateProgFile)
+            if type(backend) is not MaterializedBackend:
+                yprint('Candidate program is recursive, fall back to evaluation per rule set')
+        self.backend = backend
+
+        self.pool = None
+        if args.jobs > 1 and type(backend) is not MaterializedBackend:
+            self.pool = EvaluationPool(backend, args.jobs, f'{problemDirName}/..')
+
+        self.evalCache = EvaluationCache(args.eval_cache, problemDirName)
+
+        # the candidate program is only parsed for the features analyzing it
+        features = {'--coprov': self.setting_coprov == "1", '--precheck': args.precheck,
+                    '--subsume': args.subsume, '--optimize': args.optimize}
+        self.candidateDatalog = getattr(backend, 'datalog', None)
+        if self.candidateDatalog is None and (args.prov_cache > 0 or any(features.values())):
+            self.candidateDatalog = try_parse_datalog(
+                problemDirName if self.setting_coprov == "1" or args.precheck else None, candidateProgFile)
+            if self.candidateDatalog is None:
+                disabled = [name for name, used in features.items() if used]
+                yprint(f'Cannot parse the candidate program ({progr}), proofs are cached by every enabled rule' +
+                       (f', {" ".join(disabled)} ignored' if disabled else ''))
+                self.setting_coprov = "0"
+                args.precheck = args.subsume = args.optimize = False
+        candidateDatalog = self.candidateDatalog
+
+        # the proof of a tuple only depends on the rules enabled in the dependency cone of its relation,
+        # on every enabled rule if the program is not parsed
+        relationCones = {}
+        if candidateDatalog is not None:
+            _, relationCones = dependency_cones(candidateDatalog)
+        self.provCache = ProvenanceCache(args.prov_cache, relationCones)
+
+        # the rules of every derivation of an expected tuple, computed once with all rules enabled:
+        # a candidate lacking a tuple only produces it by enabling one of these rules,
+        # unless enabling a rule removes tuples through a negation
+        # None if the candidate program is not parsed
+        self.monotone = is_monotone(candidateDatalog) if candidateDatalog is not None else None
+        if self.setting_coprov == "1" and not self.monotone:
+            yprint(f'Candidate program negates derived relations, no co-provenance constraints ({progr})')
+            self.setting_coprov = "0"
+        self.coprovenance = {}
+        if self.setting_coprov == "1":
+            self.coprovenance = candidateDatalog.coprovenance(
+                allRuleNames, [(relName, t) for relName in idbRelationsExpected
+                               for t in idbRelationsExpected[relName]])
+
+        # proofs of unproduced tuples are asked to a session with every rule enabled,
+        # opened at the first of them and kept for the whole run
+        self.fullSession = None
+        self.fullProofs = {}
+        # a proof clause only asks for the rules of one derivation, the tuple may have others:
+        # these clauses are dropped, and proofs given up, once no candidate satisfies them all
+        self.whynotProof = args.whynot_proof
+        self.proofClauses = []
+
+        # found gets wait for their put in a queue drained by background processes
+        self.putPool = None
+        if progr == EFile.GET and args.put_jobs > 1:
+            from synthbx.core.synthesize import PutPool
+            self.putPool = PutPool(f'{problemDirName}/../..', self.options, args.put_jobs)
+
+        # 1c. Initialize the constraint solver
+
+        # clauses are only added, satisfiability is checked once per iteration
+        # optimizing selection weighs rules by their body size, constants and invented relations
+        self.ruleWeights = rule_weights(candidateDatalog, allRuleNames) if args.optimize else None
+        self.solver = make_solver(args.solver, allRuleNames, self.ruleWeights)
+
+        # visited candidates, solutions and clauses added to the solver, for O(1) dedup
+        self.store = ConstraintStore(allRuleNames)
+        store, solver = self.store, self.solver
+
+        if args.subsume:
+            # a rule subsumed by another enabled rule never changes the outputs
+            for pos, neg in structural_clauses(candidateDatalog, allRuleNames):
+                if store.add_clause(pos, neg, 'subsumption between rules'):
+                    solver.add_clause(pos, neg)
+            cprint(f'[+] Structural constraints ({progr}): {len(store.clauses)}')
+
+        self.clauseFile = None
+        if args.warm_start:
+            # clauses are saved under the content hash of every input, a changed input starts afresh
+            digest = problem_digest(problemDirName, candidateProgFile, self.ruleNameFile)
+            self.clauseFile = f'{problemDirName}/../{CLAUSE_FOLDER}/{progr[:-3]}.{digest}.json'
+            reloaded = store.load(self.clauseFile)
+            for pos, neg in reloaded:
+                solver.add_clause(pos, neg)
+            self.counters.constraints += len(reloaded)
+            cprint(f'[+] Reloaded clauses ({progr}): {len(reloaded)}')
+
+        # (firstFlag, nEmptyRMinus) of the search, kept for checkpoints
+        self.searchState = (True, 0)
+        self.priorRuntime = 0
+        self.lastCheckpoint = time.clock_gettime(0)
+        if checkpoint is not None:
+            self.resume(checkpoint)
+
+    def readCheckpoint(self):
+        """
+        Last checkpoint of a search on the same facts and expected tuples, None if there is none;
+        the candidate rules it was taken on are restored, their generation may number them otherwise
+        """
+        if not os.path.exists(self.checkpointFile):
+            yprint(f'No checkpoint to resume from ({self.progr})')
+            return None
+        with open(self.checkpointFile) as fr:
+            checkpoint = json.load(fr)
+        if checkpoint['digest'] != problem_digest(self.problem_dir):
+            yprint(f'Checkpoint of other inputs, search started afresh ({self.progr})')
+            return None
+
+        for filename, text in [(self.candidateProgFile, checkpoint['candidate']),
+                               (f'{self.problem_dir}/../{EFile.CGET}', checkpoint['candidate']),
+                               (self.ruleNameFile, checkpoint['rule_names'])]:
+            with open(filename, 'w') as fw:
+                fw.write(text)
+        return checkpoint
+
+    def resume(self, checkpoint):
+        store, solver = self.store, self.solver
+        restored = store.restore(checkpoint['store'])
+        for pos, neg in restored:
+            solver.add_clause(pos, neg)
+
+        vars(self.counters).update(checkpoint['counters'])
+        solver.checks = self.counters.z3
+        self.searchState = tuple(checkpoint['search'])
+        self.whynotProof = checkpoint['whynot_proof']
+        self.proofClauses = [(set(pos), set(neg)) for pos, neg in checkpoint['proof_clauses']]
+        # every run has the whole timeout, the time spent before the checkpoint is only reported
+        self.priorRuntime = checkpoint['runtime']
+        version, internal, gauss = checkpoint['random']
+        random.setstate((version, tuple(internal), gauss))
+
+        # gets waiting for their put when the checkpoint was taken are excluded by a clause already,
+        # they are queued again
+        if checkpoint['pending'] and self.putPool is None:
+            from synthbx.core.synthesize import PutPool
+            self.putPool = PutPool(f'{self.problem_dir}/../..', self.options, 1)
+        for rules in checkpoint['pending']:
+            self.writeProgram(rules)
+            self.putPool.submit(set(rules))
+
+        cprint(f'[+] Resumed ({self.progr}): iteration {self.counters.iterations}, '
+               f'{len(restored)} clauses, {len(checkpoint["pending"])} gets waiting for put, '
+               f'{self.priorRuntime:.2f} s spent before, {self.settings.timeout} s left')
+
+    def writeCheckpoint(self):
+        with open(self.candidateProgFile) as fr:
+            candidate = fr.read()
+        with open(self.ruleNameFile) as fr:
+            ruleNames = fr.read()
+        checkpoint = {
+            'digest': problem_digest(self.problem_dir),
+            'candidate': candidate,
+            'rule_names': ruleNames,
+            'runtime': self.priorRuntime + time.clock_gettime(0) - self.startTime,
+            'counters': vars(self.counters),
+            'search': self.searchState,
+            'whynot_proof': self.whynotProof,
+            'proof_clauses': [[sorted(pos), sorted(neg)] for pos, neg in self.proofClauses],
+            'random': random.getstate(),
+            'store': self.store.state(),
+            'pending': [sorted(rules) for rules in self.putPool.queued()]
+            if self.putPool is not None else [],
+        }
+
+        # written aside then renamed, a run killed meanwhile leaves the previous checkpoint
+        os.makedirs(os.path.dirname(self.checkpointFile), exist_ok=True)
+        with open(f'{self.checkpointFile}.tmp', 'w') as fw:
+            json.dump(checkpoint, fw)
+        os.replace(f'{self.checkpointFile}.tmp', self.checkpointFile)
+        self.lastCheckpoint = time.clock_gettime(0)
+
+    def close(self):
+        # a timeout stops between iterations and is checkpointed, an interrupted search keeps its
+        # last checkpoint, a search ended by a solution or a proof that there is none is not resumed
+        if self.checkpointFile is not None:
+            if self.status == TIMEOUT:
+                self.writeCheckpoint()
+            elif self.status is not None and os.path.exists(self.checkpointFile):
+                os.remove(self.checkpointFile)
+        if self.putPool is not None:
+            self.putPool.cancel()
+        if self.fullSession is not None:
+            self.fullSession.__exit__(None, None, None)
+            self.fullSession = None
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+        if self.clauseFile is not None:
+            self.store.save(self.clauseFile)
+
+    def evaluateAll(self, ruleSets):
+        # rule sets already evaluated are answered by the cache without running the backend
+        evalCache = self.evalCache
+
+        outputs = {}
+        missing = {}
+        for ruleSet in ruleSets:
+            key = evalCache.key(ruleSet)
+            if key not in outputs and key not in missing:
+                cached = evalCache.get(key)
+                if cached is None:
+                    missing[key] = ruleSet
+                else:
+                    outputs[key] = cached
+
+        if missing:
+            self.counters.souffle += len(missing)
+            if self.pool is not None:
+                results = self.pool.map(list(missing.values()))
+            else:
+                results = [self.backend.evaluate(ruleSet)
+                           for ruleSet in missing.values()]
+            for key, result in zip(missing, results):
+                outputs[key] = result
+                evalCache.put(key, result)
+
+        return [outputs[evalCache.key(ruleSet)] for ruleSet in ruleSets]
+
+    def countSession(self):
+        self.counters.souffle += 1
+
+    def openSession(self, ruleSet):
+        if self.settings.tiered:
+            # outputs are compared with the expected ones first,
+            # the provenance session only starts with the first explain query
+            return TieredSession(self.backend, ruleSet, self.evaluateAll([ruleSet])[0], self.countSession)
+
+        self.countSession()
+        return self.backend.session(ruleSet)
+
+    def precheck(self):
+        # a rule producing an undesired tuple by itself is never enabled,
+        # the search ends if an expected tuple is then produced by no candidate
+        doomed = doomed_rules(self.candidateDatalog, self.allRuleNames, self.idbRelationsExpected)
+        for ruleName, (relName, t) in sorted(doomed.items()):
+            if self.store.add_clause(neg={ruleName}, reason=f'Rule({ruleName}) alone produces undesired {relName}{t}'):
+                self.solver.add_clause(neg={ruleName})
+                self.counters.constraints += 1
+        cprint(f'[+] Rules producing undesired tuples ({self.progr}): {len(doomed)}')
+
+        lines = []
+        infeasible = infeasible_tuples(self.candidateDatalog, self.allRuleNames, self.idbRelationsExpected, doomed)
+        for (relName, t), blocking in infeasible:
+            if not blocking:
+                lines.append(f'{relName}{t} is desirable and no candidate rule derives it')
+                continue
+            lines.append(f'{relName}{t} is desirable and only derived with rules {", ".join(blocking)}')
+            lines += [f'  Rule({ruleName}) alone produces undesired {doomed[ruleName][0]}{doomed[ruleName][1]}'
+                      for ruleName in blocking]
+        return lines
+
+    def unsatCore(self):
+        # a subset-minimal set of the learned clauses without model, by the tuples they were learned from
+        clauses = self.store.explained_clauses()
+        core = unsat_core(self.allRuleNames, [(pos, neg) for pos, neg, _ in clauses]) or []
+        lines = []
+        for i in core:
+            pos, neg, reason = clauses[i]
+            clause = ' or '.join(sorted(pos) + [f'not {ruleName}' for ruleName in sorted(neg)])
+            lines.append(f'[{clause}] because {reason}')
+        return lines
+
+    ####################################################################################################################
+    # 3b. Functions to query provenance
+    #		The provenance object returned by Souffle is a list of hypothesis provenance objects H*, each of which is
+    #		of the form:
+    #		1. { 'axiom': T }, for a tuple T, or
+    #		2. { 'premises': T, 'children': H* }, for a tuple T, and a list of hypothesis provenance objects, H*
+
+    def isDesirable(self, relName, t):
+        return relName in self.idbRelationsExpected and t in self.idbRelationsExpected[relName]
+
+    def processProvenance(self, provenance):
+        # the rules of a proof tree, without the proofs of desirable conclusions,
+        # are collected in one pass over the reply
+        if provenance == "error reading":
+            # logging.info('Error reading 3')
+            return "error reading"
+        rules = proof_rules(provenance, self.isDesirable)
+        if rules is None:
+            logging.info('Error reading 2')
+            return "error reading"
+        return rules
+
+    def getProvenances(self, session, currRuleSetLarge, queries):
+        # tuples explained under the same rules of their dependency cone are answered by the cache,
+        # the other explain queries are pipelined to the session, replies come back in order
+        provCache = self.provCache
+        keys = [provCache.key(relName, t, currRuleSetLarge) for relName, t in queries]
+        ans = [provCache.get(key) for key in keys]
+        missing = [i for i, rules in enumerate(ans) if rules is None]
+
+        replies = session.explain_all([queries[i] for i in missing])
+        for i, reply in zip(missing, replies):
+            ans[i] = self.processProvenance(reply)
+            if ans[i] != "error reading":
+                ans[i] = frozenset(ans[i])
+                provCache.put(keys[i], ans[i])
+        return ans
+
+    def minimizeWhy(self, relName, t, rules):
+        # rules without which t is still produced are dropped, deletions are evaluated
+        # speculatively a batch at a time, at most why_budget evaluations per constraint
+        rules = list(rules)
+        budget = self.settings.why_budget
+        k = 0
+
+        while k < len(rules) and budget > 0:
+            batch = rules[k:k + min(self.settings.jobs, budget)]
+            budget -= len(batch)
+            outputs = self.evaluateAll([set(rules) - {ruleName} for ruleName in batch])
+
+            for ruleName, produced in zip(batch, outputs):
+                if t in produced[relName]:
+                    rules.remove(ruleName)
+                    break
+                k += 1
 
-atexit.register(printTimer)
-
-logging.basicConfig(
-    level=logging.INFO,
-    format=" %(levelname)s [%(name)s.%(funcName)s:%(lineno)d] %(message)s",
-    datefmt="%H:%M:%S"
-)
-
-# 1a. Load the set of rules and IDB relations
-
-allRuleNames = {name.strip() for name in open(ruleNameFile) if name.strip()}
-allRuleNames = {name: z3.Bool(name) for name in allRuleNames}
-
-
-def loadRelation(filename):
-    ans = {line.strip() for line in open(filename) if line.strip()}
-    ans = {tuple(line.split('\t')) for line in ans}
-    return ans
-
-
-idbRelationsExpected = {name for name in os.listdir(
-    problemDirName) if name.endswith('.expected')}
-idbRelationsExpected = {name[:-len('.expected')]
-                        for name in idbRelationsExpected}
-idbRelationsExpected = {name: loadRelation(
-    problemDirName + '/' + name + '.expected') for name in idbRelationsExpected}
-
-outputSet = set()
-with open(candidateProgFile, 'r') as fr:
-    for line in fr:
-        if re.search(r'\.output (\w+)', line.strip()):
-            outputSet.add(line.strip()[len('.output '):])
-
-outputSet |= idbRelationsExpected.keys()
-
-# 1b. Initialize the constraint solver
-
-solver = z3.Solver()
-# solver.add(z3.And([z3.BoolVal(True)] + [allRuleNames[str(r)] for r in range(0,7) ]))
-
-
-def satisfyingRuleSet(default):
-    global callsToZ3
-    global prevConstraints
-    global currConstraints
-    global numLoops
-    # Determines the set of rules that should be switched on to satisfy the current set of constraints
-    # Includes presently unconstrained rules iff default is true
-
-    currTime = time.clock_gettime(0)
-    prevConstraints = currConstraints
-    if solver.check() == z3.unsat or time.clock_gettime(0) - scriptStartTime > 3600:
-        printLog()
-        print('Z3 reports error in generating a model. Problem unsat.')
-        sys.exit(1)
-    m = solver.model()
-    # logging.info("z3 model generated")
-    callsToZ3 += 1
-    return {ruleName for ruleName, ruleVar in allRuleNames.items() if m[ruleVar] in [True, None]}
-
+        return rules
 
-def doSanity():
-    global prevConstraints
-    global currConstraints
-    try:
-        # yprint(f'doSanity: solver = {solver}')
-        solver.push()
-        if solver.check() == z3.unsat:
-            printLog()
-            print('Z3 reports error in generating a model. Problem unsat.')
-            sys.exit(1)
-        solver.model()
-        solver.pop()
-        return True
-    except z3.Z3Exception:
-        return False
+    def why(self, relName, t, rules):
+        if rules == "error reading":
+            # logging.info('Error reading 5')
+            return ("error reading", False)
+        # logging.info('Tuple {} depends on rules {}'.format((relName, t), sorted(rules)))
 
+        currentRuleList = sorted(rules)
 
-doSanity()
+        if not currentRuleList:
+            return (False, currentRuleList)
 
-# 1c. Helper method to create Rule.facts file
+        if self.settings.why_budget > 0:
+            currentRuleList = sorted(self.minimizeWhy(relName, t, currentRuleList))
 
+        outputStr = "WHY constraint added: [not (" + \
+            " and ".join([str(ruleName) for ruleName in currentRuleList]) + \
+            ")] because " + str(relName) + str(t) + \
+            " is undesirable and produced"
+        logging.info(outputStr)
 
-def printRuleEDB(ruleSet):
-    with open(problemDirName + '/Rule.facts', 'w') as outFile:
-        for name in ruleSet:
-            print(name, file=outFile)
+        return (True, currentRuleList)
 
-########################################################################################################################
-# 3. Repeatedly add constraints until a satisfying assignment is found
+    @staticmethod
+    def breakIntoPieces(l, numPieces):
+        avg = len(l) / float(numPieces)
+        out = []
+        last = 0.0
 
+        while last < len(l):
+            out.append(l[int(last):int(last+avg)])
+            last += avg
 
-iterationNum = 0
-callsToZ3 = 0
-callsToSouffle = 0
+        return out
 
-list_solutions = []
-list_visited_cands = []
-max_n_cands = 0
-firstFlag = True
-nEmptyRMinus = 0
+    def whyNotDelta(self, relName, t, currRuleSetLarge):
+        divisions = 2
 
-while True:
+        rMinus = set(self.allRuleNames) - currRuleSetLarge
+        rPlus = currRuleSetLarge
 
-    currRuleSetLarge = satisfyingRuleSet(True)
-    if firstFlag:
-        max_n_cands = 2 ** len(currRuleSetLarge)
-        # firstFlag = False
+        if not rMinus:
+            rMinus = currRuleSetLarge
+            rPlus = set()
 
-    if len(list_visited_cands) == max_n_cands:
-        print('Exhausted! No solutions!')
-        exit(0)
+        code = list(rMinus)
+        # logging.info(relName + '(' + str(t) + ')')
 
-    if sorted(currRuleSetLarge) in list_visited_cands:
-        added = z3.Not(z3.And([z3.BoolVal(True)] +
-                              [allRuleNames[ruleName] for ruleName in sorted(currRuleSetLarge)]))
-        solver.add(added)
-        try:
-            doSanity()
-            continue
-        except:
-            print(
-                'Z3 reports error in generating a model. Problem unsat.')
-            quit()
+        while True:
+            # logging.info(divisions)
+            codeChunks = self.breakIntoPieces(code, divisions)
+            k = 0
 
-    list_visited_cands.append(sorted(currRuleSetLarge))
+            # chunks are evaluated speculatively from the current rPlus, a batch at a time;
+            # once a chunk updates rPlus, the chunks after it are evaluated again as in sequence
+            while k < len(codeChunks):
+                batch = codeChunks[k:k + self.settings.jobs]
 
-    solved = True
+                # logging.info("Souffle invoked [within whyNotDelta]")
+                outputs = self.evaluateAll(
+                    [rPlus.union(set(codeChunk)) for codeChunk in batch])
 
-    iterationNum += 1
-    yprint(f'--------Iteration {iterationNum} --------')
-    # yprint(f'rPlus: {sorted(currRuleSetLarge)}')
-    # yprint(f'rMinus: {sorted(set(allRuleNames) - currRuleSetLarge)}')
-    yprint(f"""Calls to z3: {callsToZ3}, Calls to Souffle: {callsToSouffle}
-Culumative Number of Constraints - - Why: {numWhy}, Whynot: {str(numWhyNot)}
-""")
+                for codeChunk, produced in zip(batch, outputs):
+                    k += 1
+                    bugProduced = t not in produced[relName]
 
-    printRuleEDB(currRuleSetLarge)
-    logging.info("rPlus printed to Rule.facts")
-
-    currTime = time.clock_gettime(0)
-    os.system(f'rm -rf {problemDirName}/*.csv 2> /dev/null')
-
-    with subprocess.Popen(
-            args=cmd_args,
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            universal_newlines=True) as souffleProc:
-
-        ################################################################################################################
-        # 3a. Set up communication with Souffle
-
-        logging.info("Souffle invoked")
-        callsToSouffle += 1
-        while souffleProc.stdout.readline().strip() != '###':
-            pass
-        while souffleProc.stdout.readline().strip() != '###':
-            pass
-
-        def execSouffleCmd(cmd):
-            print(cmd, file=souffleProc.stdin)
-            souffleProc.stdin.flush()
-
-            response = [souffleProc.stdout.readline().strip()]
-            if response[-1] == '':
-                # logging.info('Error reading 1')
-                # doesn't deal with underlying problem, just passes error through and skips question
-                return "error reading"
-                # return execSouffleCmd(cmd)
-            while response[-1] != '###':
-                response.append(souffleProc.stdout.readline().strip())
-            response = response[:-1]
-            ans = '\n'.join(response)
-            # logging.info('souffle to prosynth: ' + ans)
-            return ans
-
-        execSouffleCmd('format json')
-        execSouffleCmd('setdepth 200000')
-
-        ################################################################################################################
-        # 3b. Functions to print and parse tuples in the Souffle executable format
-
-        def printSouffleString(relName, t):
-            t = tuple('"{}"'.format(x) for x in t)
-            t = ', '.join(t)
-            return '{}({})'.format(relName, t)
-
-        def parseSouffleString(string):
-            xs = string.split('(')
-            assert(len(xs) == 2)
-            relName = xs[0].strip()
-            xs = xs[1]
-            xs = xs.split(')')[0].strip()
-            xs = [x.strip() for x in xs.split(',')]
-            # for x in xs:
-            # assert(x.startswith('"') and x.endswith('"'))
-            xs = tuple([x[1:-1].strip() for x in xs])
-            return (relName, xs)
-
-        ################################################################################################################
-        # 3b. Functions to query provenance
-        #		The provenance object returned by Souffle is a list of hypothesis provenance objects H*, each of which is
-        #		of the form:
-        #		1. { 'axiom': T }, for a tuple T, or
-        #		2. { 'premises': T, 'children': H* }, for a tuple T, and a list of hypothesis provenance objects, H*
-
-        def cleanProvenanceJson(provenance):
-            orgProvenance = provenance
-
-            def cleanProvenanceJsonInt(p):
-                if type(p) is dict:
-                    p = {key: value
-                         for key, value in p.items() if key != 'rules'}
-                    p = {key: value
-                         for key, value in p.items() if key != 'rule-number'}
-                    p = {key: cleanProvenanceJsonInt(value)
-                         for key, value in p.items()}
-                elif type(p) is list:
-                    p = [cleanProvenanceJsonInt(value) for value in p]
-                return p
-            provenance = cleanProvenanceJsonInt(provenance)
-            assert(len(provenance) == 1)
-            assert('proof' in provenance)
-            if 'children' not in provenance['proof']:
-                # yprint(orgProvenance)
-                logging.info('Error reading 2')
-                return "error reading"
-            provenance = provenance['proof']['children']
-            return provenance
-
-        def squashDesirableConclusions(provenance):
-            if type(provenance) is dict:
-                if 'premises' in provenance:
-                    premiseRel, premiseT = parseSouffleString(
-                        provenance['premises'])
-                    if premiseRel in idbRelationsExpected and premiseT in idbRelationsExpected[premiseRel]:
-                        provenance = {'axiom': provenance['premises']}
+                    if bugProduced:
+                        rMinus = rMinus - set(codeChunk)
+                        rPlus = rPlus.union(set(codeChunk))
+                        break
+
+            if divisions == len(code):
+                break
+            divisions = min(len(code), divisions*2)
+            if divisions == 0:
+                break
+
+        outputStr = "WHYNOT constraint added: [" + \
+            " or ".join([str(ruleName) for ruleName in list(rMinus)]) + \
+            "] because " + str(relName) + str(t) + \
+            " is desirable and unproduced"
+        logging.info(outputStr)
+
+        return sorted(rMinus)
+
+    def whyNot(self, currRuleSetLarge):
+        ans = set()
+
+        outputStr = "WHYNOT constraint added: ["
+        for ruleName in self.allRuleNames:
+            if ruleName not in currRuleSetLarge:
+                ans.add(ruleName)
+                outputStr += str(ruleName) + " or "
+        outputStr = outputStr[:len(outputStr)-4]
+        outputStr += "] because "
+        outputStr += "there exists some tuple that is desirable and unproduced"
+        logging.info(outputStr)
+
+        return ans
+
+    def whyNotProof(self, session, relName, t, currRuleSetLarge):
+        # the rules of rMinus in one proof of t with every rule enabled, skipping the subproofs
+        # of tuples the candidate produces; None if t has no proof
+        if self.fullSession is None:
+            self.fullSession = self.openSession(set(self.allRuleNames)).__enter__()
+        if t not in self.fullSession.outputs[relName]:
+            return None
+        if (relName, t) not in self.fullProofs:
+            self.fullProofs[(relName, t)] = self.fullSession.explain(relName, t)
+
+        rules = proof_rules(self.fullProofs[(relName, t)],
+                            lambda r, x: r in session.outputs and x in session.outputs[r])
+        neededRules = sorted((rules or set()) - currRuleSetLarge)
+        if not neededRules:
+            return None
+
+        outputStr = "WHYNOT constraint added: [" + \
+            " or ".join([str(ruleName) for ruleName in neededRules]) + \
+            "] because " + str(relName) + str(t) + \
+            " is desirable and unproduced, by its proof"
+        logging.info(outputStr)
+
+        return neededRules
+
+    def dropProofClauses(self):
+        """
+        Remove the proof clauses from the store and rebuild the solver without them,
+        unproduced tuples being constrained by delta debugging from now on
+        """
+        yprint(f'No candidate satisfies the proof clauses ({self.progr}): {len(self.proofClauses)} dropped')
+        self.store.discard(self.proofClauses)
+        self.proofClauses = []
+        self.whynotProof = False
+        # candidates only ruled out by a proof clause are evaluated again
+        self.store.visited.clear()
+
+        checks = self.solver.checks
+        self.solver = make_solver(self.settings.solver, self.allRuleNames, self.ruleWeights)
+        self.solver.checks = checks
+        for pos, neg, _ in self.store.explained_clauses():
+            self.solver.add_clause(pos, neg)
+        return self.solver
+
+    def whyNotCoprov(self, relName, t, currRuleSetLarge):
+        # no evaluation: some rule outside the candidate deriving t with all rules enabled
+        rMinus = set(self.allRuleNames) - currRuleSetLarge
+        neededRules = sorted(rMinus & self.coprovenance.get((relName, t), set()))
+        if not neededRules:
+            return neededRules
+
+        outputStr = "COPROV constraint added: [" + \
+            " or ".join([str(ruleName) for ruleName in neededRules]) + \
+            "] because " + str(relName) + str(t) + \
+            " is desirable and unproduced"
+        logging.info(outputStr)
+
+        return neededRules
+
+    def writeProgram(self, ans):
+        # the candidate program restricted to the enabled rules, without the Rule relation
+        p_ans = sorted([int(i) for i in ans])
+        ans = r'Rule\(({})\)'.format('|'.join([str(i) for i in p_ans]))
+        logging.info(ans)
+        ans = re.compile(ans)
+
+        program = self.problem_dir + '/../' + self.progr
+        with open(self.candidateProgFile, 'r') as fr:
+            with open(program, 'w') as fw:
+                wr = []
+                for line in fr:
+                    line = line.replace('\n', '')
+                    if line.startswith('.'):
+                        if 'Rule' not in line:
+                            wr += [line]
                     else:
-                        provenance = {key: squashDesirableConclusions(
-                            value) for key, value in provenance.items()}
-            elif type(provenance) is list:
-                provenance = [squashDesirableConclusions(
-                    elem) for elem in provenance]
-            return provenance
-
-        def collectIntermediateConclusions(provenance):
-            if type(provenance) is dict:
-                premises = {premise for key, value in provenance.items(
-                ) for premise in collectIntermediateConclusions(value)}
-                if 'premises' in provenance:
-                    premises = premises | {
-                        parseSouffleString(provenance['premises'])}
-                return premises
-            elif type(provenance) is list:
-                return {premise for elem in provenance for premise in collectIntermediateConclusions(elem)}
-            else:
-                return set()
-
-        def collectRules(provenance):
-            if type(provenance) is dict:
-                rules = {rule for key, value in provenance.items()
-                         for rule in collectRules(value)}
-                if 'axiom' in provenance and provenance['axiom'].startswith('Rule'):
-                    rules = rules | {provenance['axiom'][len('Rule') + 1:-1]}
-                return rules
-            elif type(provenance) is list:
-                rules = {
-                    rule for elem in provenance for rule in collectRules(elem)}
-                return rules
+                        pat1 = r',[ \t]*Rule\(\d+\)[ \t]*\.'
+                        pat2 = r' :- Rule\(\d+\).'
+                        if not re.findall(pat1, line) and not re.findall(pat2, line):
+                            wr += [line]
+                        elif ans.search(line):
+                            if re.findall(pat1, line):
+                                wr += [re.sub(pat1, '.', line)]
+                            else:
+                                wr += [re.sub(pat2, '.', line)]
+                fw.write('\n'.join(wr))
+        return program
+
+    def collectPuts(self, block):
+        # a get paired with a put is a solution, the other put syntheses go on until the run is closed
+        for rules, workspace, paired, seconds in self.putPool.poll(block):
+            self.counters.synth_time[1] += seconds
+            if paired:
+                self.putPool.install(workspace)
+                yield Result(SOLVED, self.counters, rules=rules,
+                             program=f'{self.problem_dir}/../{self.progr}')
             else:
-                return set()
-
-        def getProvenance(relName, t):
-            provenance1 = execSouffleCmd(
-                'explain ' + printSouffleString(relName, t))
-            if provenance1 == "error reading":
-                # logging.info('Error reading 3')
-                return "error reading"
-            provenance2 = json.loads(provenance1)
-            provenance3 = cleanProvenanceJson(provenance2)
-            if provenance3 == "error reading":
-                # logging.info('Error reading 4')
-                return "error reading"
-            provenance4 = squashDesirableConclusions(provenance3)
-            # if provenance3 != provenance4:
-            #     #logging.info(provenance3)
-            #     #logging.info(provenance4)
-            return provenance4
-
-        def why(relName, t):
-            # global currIgnoreSetLarge
-
-            provenance = getProvenance(relName, t)
-            if provenance == "error reading":
-                # logging.info('Error reading 5')
-                return ("error reading", False)
-            # for hypRelName, hypT in collectIntermediateConclusions(provenance):
-            #	if hypRelName in idbRelationsExpected and hypT not in idbRelationsExpected[hypRelName]:
-            #		logging.debug('Tuple {} depends on absurd hypothesis {}'.format((relName, t), (hypRelName, hypT)))
-            #		return None
-            rules = collectRules(provenance)
-            # logging.info('Tuple {} depends on rules {}'.format((relName, t), sorted(rules)))
-
-            ans = z3.BoolVal(True)
-            currentRuleList = []
-            for ruleName in rules:
-                currentRuleList.append(ruleName)
-
-            currentRuleList = sorted(currentRuleList)
-
-            # currIgnoreSetLarge |= set(currentRuleList)
-
-            if not currentRuleList:
-                return (False, ans)
-
-            outputStr = "WHY constraint added: [not (" + \
-                " and ".join([str(ruleName) for ruleName in currentRuleList]) + \
-                ")] because " + str(relName) + str(t) + \
-                " is undesirable and produced"
-            logging.info(outputStr)
-
-            ans = z3.And([z3.BoolVal(True)] + [allRuleNames[ruleName]
-                         for ruleName in currentRuleList])
-            # for ruleName in (currentRuleList):
-            # 	ans = z3.And(ans, allRuleNames[ruleName])
-            # logging.info('adding constraint: not [%s]' % ' and '.join(map(str, sorted(currentRuleList))))
-
-            return (True, ans)
-
-        def breakIntoPieces(l, numPieces):
-            avg = len(l) / float(numPieces)
-            out = []
-            last = 0.0
-
-            while last < len(l):
-                out.append(l[int(last):int(last+avg)])
-                last += avg
-
-            return out
-
-        def whyNotDelta(relName, t, currRuleSetLarge):
-            global callsToSouffle
-
-            divisions = 2
-
-            rMinus = set(allRuleNames) - currRuleSetLarge
-            rPlus = currRuleSetLarge
-
-            if not rMinus:
-                rMinus = currRuleSetLarge
-                rPlus = set()
-
-            code = list(rMinus)
-            # logging.info(relName + '(' + str(t) + ')')
-
-            while True:
-                # logging.info(divisions)
-                for codeChunk in breakIntoPieces(code, divisions):
-                    currRMinus = rMinus - set(codeChunk)
-                    currRPlus = rPlus.union(set(codeChunk))
-
-                    printRuleEDB(currRPlus)
-                    # #logging.info("currRPlus printed to Rule.facts [within whyNotDelta]")
-                    subproc = subprocess.Popen(
-                        [souffle_exec, '-w', '-t', 'explain', '-F',
-                            problemDirName, '-D', problemDirName, candidateProgFile],
-                        stdin=subprocess.PIPE,
-                        stdout=subprocess.PIPE,
-                        universal_newlines=True
-                    )
-                    # logging.info("Souffle invoked [within whyNotDelta]")
-                    callsToSouffle += 1
-                    subproc.communicate()
-                    relProduced = loadRelation(
-                        problemDirName + '/' + relName + '.csv')
-                    bugProduced = True
-                    for tt in relProduced:
-                        if tt == t:
-                            bugProduced = False
+                yprint(f'No put could pair with get {str(rules)}')
+
+    def drainPuts(self):
+        # no get is left to find, the found ones still wait for their put
+        while self.putPool is not None and len(self.putPool):
+            yield from self.collectPuts(True)
+
+    ####################################################################################################################
+    # 3. Repeatedly add constraints until a satisfying assignment is found
+
+    def search(self):
+        args = self.settings
+        counters = self.counters
+        store, solver = self.store, self.solver
+        allRuleNames = self.allRuleNames
+        idbRelationsExpected = self.idbRelationsExpected
+        setting_coprov, setting_delta = self.setting_coprov, self.setting_delta
+        progr = self.progr
+
+        if args.precheck:
+            lines = self.precheck()
+            if lines:
+                self.printLog()
+                print(f'Problem infeasible ({progr}):')
+                for line in lines:
+                    print(f'  {line}')
+                yield Result(INFEASIBLE, counters, reasons=lines)
+                return
+
+        max_n_cands = 2 ** len(allRuleNames)
+        firstFlag, nEmptyRMinus = self.searchState
+
+        while True:
+            self.searchState = (firstFlag, nEmptyRMinus)
+            if args.checkpoint > 0 and self.checkpointFile is not None and \
+                    time.clock_gettime(0) - self.lastCheckpoint >= args.checkpoint:
+                self.writeCheckpoint()
+
+            if self.putPool is not None:
+                yield from self.collectPuts(False)
+
+            # Determines the set of rules that should be switched on to satisfy the current set of constraints
+            if time.clock_gettime(0) - self.startTime > args.timeout:
+                self.printLog()
+                print(f'Timeout after {args.timeout} s.')
+                yield Result(TIMEOUT, counters)
+                return
+            if not solver.check():
+                if self.proofClauses:
+                    solver = self.dropProofClauses()
+                    continue
+                yield from self.drainPuts()
+                self.printLog()
+                print(f'The {solver.name} solver finds no model. Problem unsat.')
+                lines = self.unsatCore()
+                for line in lines:
+                    print(f'  {line}')
+                yield Result(UNSAT, counters, reasons=lines)
+                return
+            # logging.info("z3 model generated")
+            counters.z3 = solver.checks
+            currRuleSetLarge = solver.model()
+
+            if len(store.visited) == max_n_cands:
+                yield from self.drainPuts()
+                print('Exhausted! No solutions!')
+                yield Result(EXHAUSTED, counters)
+                return
+
+            if store.is_visited(currRuleSetLarge):
+                if store.add_clause(neg=currRuleSetLarge, reason='the candidate was already visited',
+                                    local=True):
+                    solver.add_clause(neg=currRuleSetLarge)
+                continue
 
-                    if bugProduced:
-                        rMinus = currRMinus
-                        rPlus = currRPlus
+            store.visit(currRuleSetLarge)
 
-                if divisions == len(code):
-                    break
-                divisions = min(len(code), divisions*2)
-                if divisions == 0:
-                    break
+            solved = True
 
-            outputStr = "WHYNOT constraint added: [" + \
-                " or ".join([str(ruleName) for ruleName in list(rMinus)]) + \
-                "] because " + str(relName) + str(t) + \
-                " is desirable and unproduced"
-            logging.info(outputStr)
-
-            return sorted(rMinus)
-
-        def whyNot():
-            ans = z3.BoolVal(False)
-
-            outputStr = "WHYNOT constraint added: ["
-            for ruleName in allRuleNames:
-                if ruleName not in currRuleSetLarge:
-                    ans = z3.Or(ans, allRuleNames[ruleName])
-                    outputStr += str(ruleName) + " or "
-            outputStr = outputStr[:len(outputStr)-4]
-            outputStr += "] because "
-            outputStr += "there exists some tuple that is desirable and unproduced"
-            logging.info(outputStr)
-
-            return ans
-
-        ################################################################################################################
-        # 3c. Iterate over all tuples
-        # if setting_coprov == "1":
-        #     pass
-            # printRuleEDB(currRuleSetLarge)
-            # #logging.info("rPlus printed to Rule.facts")
-            # myProc = subprocess.Popen(
-            # 	[problemDirName + '/souffle_notexists.small.out', '-F', problemDirName, '-D', problemDirName])
-            # #logging.info("Souffle_notexists invoked")
-            # callsToSouffle += 1
-            # myProc.communicate()
-            # for relName in idbRelationsExpected:
-            # 	tE = idbRelationsExpected[relName]
-
-            # 	notExistsData = {line.strip() for line in open(problemDirName + '/' + relName + '_notexists.csv') if line.strip()}
-            # 	notExistsData = {tuple(line.split('\t')) for line in notExistsData}
-
-            # 	coprov = dict()
-            # 	for rel in notExistsData:
-            # 		coprov[rel[:len(rel)-1]] = set()
-
-            # 	for rel in notExistsData:
-            # 		coprov[rel[:len(rel)-1]].add(rel[len(rel) - 1])
-
-            # 	for cp in coprov.keys():
-            # 		coprov[cp] = currRuleSetLarge - coprov[cp]
-
-            # 	neededRules = set()
-            # 	for t in tE:
-            # 		if t in coprov:
-            # 			# if coprov[t] != None:
-            # 			#    #logging.info(str(t) + " has coprov " + str(coprov[t]))
-            # 			neededRules = neededRules.union(set(coprov[t]))
-
-            # 	if len(neededRules) != 0:
-            # 		smallRMinus = set(allRuleNames) - currRuleSetLarge
-
-            # 		outputStr = "COPROV constraint added: ("
-
-            # 		allNotRMinus = z3.BoolVal(True)
-            # 		for ruleName in smallRMinus:
-            # 			allNotRMinus = z3.And(allNotRMinus, z3.Not(allRuleNames[ruleName]))
-            # 			outputStr += "not " + str(ruleName) + " and "
-            # 		allNeededRules = z3.BoolVal(True)
-
-            # 		outputStr = outputStr[:len(outputStr)-5]
-
-            # 		outputStr += ") => ("
-
-            # 		for ruleName in neededRules:
-            # 			allNeededRules = z3.And(allNeededRules, allRuleNames[ruleName])
-            # 			outputStr += str(ruleName) + " and "
-
-            # 		outputStr = outputStr[:len(outputStr)-5]
-            # 		outputStr += ")"
-            # 		#logging.info(outputStr)
-
-            # 		solver.add(z3.Implies(allNotRMinus, allNeededRules))
-            # 		currConstraints = currConstraints + 1
-
-        whyNotFlag = True
-        whyFlag = False
-
-        for relName in idbRelationsExpected:
-            relProduced = loadRelation(problemDirName + '/' + relName + '.csv')
-
-            # 3c(i) Tuples which are expected and produced
-            # We do not have anything to learn from these tuples
-            # for t in relProduced & idbRelationsExpected[relName]:
-            # logging.info('Solution produces desirable tuple: ' + printSouffleString(relName, t))
-
-            # 3c(ii) Tuples which are unexpected but still produced
-            # Here, we ask the question: ``Why was this tuple produced?''
-
-            newWhys = 0
-            currUndesiredTuples = list(
-                relProduced - idbRelationsExpected[relName])
-
-            random.shuffle(currUndesiredTuples)
-            for i, t in enumerate(currUndesiredTuples):
-                solved = False
-                whyRelT = why(relName, t)
-                if whyRelT[0] == "error reading":
-                    logging.info(f"\n{relName}{t}: Error reading 6")
-                    break
-                elif whyRelT[1] != None:
-                    if whyRelT[0] == True:
-                        if hash(whyRelT[1]) not in [hash(c) for c in solver.assertions()]:
-                            solver.add(z3.Not(whyRelT[1]))
-                            currConstraints += 1
-                            numWhy += 1
-                            whyFlag = True
-                            doSanity()
-                if i > 20:
-                    break
+            counters.iterations += 1
+            yprint(f'--------Iteration {counters.iterations} --------')
+            # yprint(f'rPlus: {sorted(currRuleSetLarge)}')
+            # yprint(f'rMinus: {sorted(set(allRuleNames) - currRuleSetLarge)}')
+            yprint(f"""Calls to z3: {counters.z3}, Calls to Souffle: {counters.souffle}
+Culumative Number of Constraints - - Why: {counters.why}, Whynot: {str(counters.whynot)}
+""")
 
-            # 3c(iii) Tuples which were expected but not produced
-            # Here, we ask the question: ``Why was this tuple not produced?''
-        if firstFlag & whyFlag:
-            firstFlag = False
-            continue
-
-        for relName in idbRelationsExpected:
-            relProduced = loadRelation(problemDirName + '/' + relName + '.csv')
-
-            if whyNotFlag:
-                unproducedDesirable = False
-                oldCRSL = copy.deepcopy(currRuleSetLarge)
-
-                for t in (idbRelationsExpected[relName] - relProduced):
-                    currRuleSetLarge = copy.deepcopy(oldCRSL)
-                    solved = False
-
-                    whyNotRelT = z3.BoolVal(False)
-
-                    if setting_delta == "1":
-                        smallRMinus = whyNotDelta(relName, t, currRuleSetLarge)
-                        if sorted(smallRMinus) == sorted(currRuleSetLarge):
-                            whyNotFlag = False
-                            added = z3.Not(z3.And([z3.BoolVal(True)] +
-                                           [allRuleNames[ruleName] for ruleName in sorted(currRuleSetLarge)]))
-                            whyNotRelT = added
-                        elif not smallRMinus:
-                            nEmptyRMinus += 1
-                            if nEmptyRMinus < 10:
-                                whyNotFlag = False
-                                added = z3.Not(z3.And([z3.BoolVal(True)] +
-                                                      [allRuleNames[ruleName] for ruleName in sorted(currRuleSetLarge)]))
-                                whyNotRelT = added
-                        else:
-                            for ruleName in smallRMinus:
-                                whyNotRelT = z3.Or(
-                                    whyNotRelT, allRuleNames[ruleName])
+            with self.openSession(currRuleSetLarge) as session:
+
+                ########################################################################################################
+                # 3a. Set up communication with the evaluation backend
+
+                logging.info("Souffle invoked")
+                self.evalCache.put(self.evalCache.key(currRuleSetLarge), session.outputs)
+
+                ########################################################################################################
+                # 3c. Iterate over all tuples
+                whyNotFlag = True
+                whyFlag = False
+
+                for relName in idbRelationsExpected:
+                    relProduced = session.outputs[relName]
+
+                    # 3c(i) Tuples which are expected and produced
+                    # We do not have anything to learn from these tuples
+
+                    # 3c(ii) Tuples which are unexpected but still produced
+                    # Here, we ask the question: ``Why was this tuple produced?''
+
+                    currUndesiredTuples = list(
+                        relProduced - idbRelationsExpected[relName])
+
+                    random.shuffle(currUndesiredTuples)
+
+                    # at most 22 undesired tuples are asked why, explained as one batch
+                    currUndesiredTuples = currUndesiredTuples[:22]
+                    provenances = self.getProvenances(
+                        session, currRuleSetLarge, [(relName, t) for t in currUndesiredTuples])
+
+                    for i, (t, rules) in enumerate(zip(currUndesiredTuples, provenances)):
+                        solved = False
+                        whyRelT = self.why(relName, t, rules)
+                        if whyRelT[0] == "error reading":
+                            logging.info(f"\n{relName}{t}: Error reading 6")
+                            break
+                        elif whyRelT[1] != None:
+                            if whyRelT[0] == True:
+                                if store.add_clause(neg=whyRelT[1],
+                                                    reason=f'{relName}{t} is undesirable and produced'):
+                                    solver.add_clause(neg=whyRelT[1])
+                                    counters.constraints += 1
+                                    counters.why += 1
+                                    whyFlag = True
+                        if i > 20:
+                            break
+
+                    # 3c(iii) Tuples which were expected but not produced
+                    # Here, we ask the question: ``Why was this tuple not produced?''
+                if firstFlag & whyFlag:
+                    firstFlag = False
+                    continue
+
+                for relName in idbRelationsExpected:
+                    relProduced = session.outputs[relName]
+
+                    if whyNotFlag:
+                        oldCRSL = copy.deepcopy(currRuleSetLarge)
+
+                        for t in (idbRelationsExpected[relName] - relProduced):
+                            currRuleSetLarge = copy.deepcopy(oldCRSL)
+                            solved = False
+
+                            # (pos, neg): some rule of pos enabled or some rule of neg disabled,
+                            # the empty clause if no constraint is found
+                            whyNotClause = ((), ())
+
+                            neededRules = None
+                            if self.whynotProof and setting_coprov != "1":
+                                neededRules = self.whyNotProof(session, relName, t, currRuleSetLarge)
+
+                            # delta debugging if no rule outside the candidate derives t with all rules enabled
+                            coprovRules = None
+                            if setting_coprov == "1":
+                                coprovRules = self.whyNotCoprov(relName, t, currRuleSetLarge)
+
+                            if coprovRules:
+                                whyNotClause = (coprovRules, ())
+                            elif neededRules:
+                                whyNotClause = (neededRules, ())
+                            elif setting_delta == "1":
+                                smallRMinus = self.whyNotDelta(relName, t, currRuleSetLarge)
+                                # the candidate is excluded with its supersets,
+                                # alone if a superset may produce t through a negation
+                                candidateClause = ((), currRuleSetLarge) if self.monotone is not False \
+                                    else (set(allRuleNames) - currRuleSetLarge, currRuleSetLarge)
+                                if sorted(smallRMinus) == sorted(currRuleSetLarge):
+                                    whyNotFlag = False
+                                    whyNotClause = candidateClause
+                                elif not smallRMinus:
+                                    nEmptyRMinus += 1
+                                    if nEmptyRMinus < 10:
+                                        whyNotFlag = False
+                                        whyNotClause = candidateClause
+                                else:
+                                    whyNotClause = (smallRMinus, ())
+                            else:
+                                whyNotClause = (self.whyNot(currRuleSetLarge), ())
+
+                            if store.add_clause(*whyNotClause,
+                                                reason=f'{relName}{t} is desirable and unproduced',
+                                                local=bool(neededRules)):
+                                solver.add_clause(*whyNotClause)
+                                if neededRules:
+                                    self.proofClauses.append(whyNotClause)
+                            counters.constraints += 1
+                            counters.whynot += 1
+
+                            # co-provenance constrains every unproduced tuple at no cost
+                            if not coprovRules:
+                                break
+
+                        if not whyNotFlag:
+                            break
+
+                ########################################################################################################
+                # 3d. Find useful rules
+
+                if solved:
+                    self.printLog()
+                    ans = set()
+
+                    if not firstFlag:
+                        queries = [(relName, t) for relName in self.outputSet
+                                   if relName in idbRelationsExpected
+                                   for t in idbRelationsExpected[relName]]
+                        for rules in self.getProvenances(session, currRuleSetLarge, queries):
+                            if rules != "error reading":
+                                ans |= rules
                     else:
-                        whyNotRelT = whyNot()
+                        ans = set(currRuleSetLarge)
+
+                    s_ans = ans
+                    if not store.add_solution(s_ans):
+                        continue
+
+                    program = self.writeProgram(ans)
+
+                    if progr == EFile.GET:
+                        counters.gets += 1
+                        mark1 = time.clock_gettime(0)
+                        counters.synth_time[0] += (mark1 - self.mark0[0])
+                        self.mark0[0] = mark1
+                        path = f'{self.problem_dir}/../..'
+
+                        if self.putPool is not None:
+                            # the put of this get is synthesized in the background, other gets are searched
+                            # its exclusion holds for this run only, the get may pair
+                            self.putPool.submit(s_ans)
+                            if store.add_clause(neg=s_ans, reason='the get waits for its put',
+                                                local=True):
+                                counters.constraints += 1
+                                solver.add_clause(neg=s_ans)
+                            continue
 
-                    if whyNotRelT != None:
-                        solver.add(whyNotRelT)
-                        currConstraints += 1
-                        numWhyNot += 1
-                        unproducedDesirable = True
                         try:
-                            doSanity()
-                        except:
-                            dataLogStr = "{" + f"name: '{problemDirName}', " + \
-                                f"z3: {callsToZ3}, souffle: {callsToSouffle}, " + \
-                                f"runtime: {time.clock_gettime(0) - scriptStartTime}, " + \
-                                f"setting_delta: {setting_delta}" + "}"
-                            with open(data_file, 'a+') as f:
-                                print(dataLogStr, file=f)
-                            print(
-                                'Z3 reports error in generating a model. Problem unsat.')
-                            quit()
+                            from synthbx.core.synthesize import p_synthesize
+                            paired = bool(p_synthesize(path, self.options))
+                        except (FileNotFoundError, SouffleError) as e:
+                            # the examples of put could not be built, the get is left unpaired
+                            yprint(f'Put of get {str(s_ans)} failed: {e}')
+                            paired = False
+
+                        if not paired:
+                            if EFile.PUT not in os.listdir(f'{path}/{EFolder.SYNTH}'):
+                                yprint(f'No put could pair with get {str(s_ans)}')
+
+                            mark2 = time.clock_gettime(0)
+                            counters.synth_time[1] += mark2 - mark1
+                            self.mark0[0] = mark2
+
+                            if store.add_clause(neg=s_ans, reason='no put pairs with the get',
+                                                local=True):
+                                counters.constraints += 1
+                                solver.add_clause(neg=s_ans)
+                            continue
+                    elif progr == EFile.PUT:
+                        mark1 = time.clock_gettime(0)
+                        counters.synth_time[1] += mark1 - self.mark0[1]
+                        self.mark0[1] = mark1
+                    else:
+                        raise Exception("Unknown progr")
 
-                    break
+                    yield Result(SOLVED, counters, rules=s_ans, program=program)
 
-                if not whyNotFlag:
-                    break
+                    # the next solution is searched among the candidates not enabling every rule of this one
+                    self.mark0 = [time.clock_gettime(0)] * 2
+                    if store.add_clause(neg=s_ans, reason='the solution was already generated',
+                                        local=True):
+                        counters.constraints += 1
+                        solver.add_clause(neg=s_ans)
+                else:
+                    firstFlag = False
 
-        ################################################################################################################
-        # 3d. Find useful rules
 
-        if solved:
-            printLog()
-            ans = set()
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
 
-            if not firstFlag:
-                for relName in outputSet:
-                    if relName in idbRelationsExpected:
-                        for t in idbRelationsExpected[relName]:
-                            for ruleName in collectRules(getProvenance(relName, t)):
-                                ans.add(ruleName)
-            else:
-                ans = set(currRuleSetLarge)
+    parser = argparse.ArgumentParser(parents=[make_parser()])
+    parser.add_argument('problemDirName')
+    parser.add_argument('setting_coprov')
+    parser.add_argument('setting_delta')
+    parser.add_argument('data_file')
+    parser.add_argument('progr')
+    args = parser.parse_args(argv)
 
-            s_ans = ans
-            if sorted(s_ans) in list_solutions:
-                continue
-            list_solutions += [sorted(s_ans)]
-
-            p_ans = sorted([int(i) for i in ans])
-            ans = r'Rule\(({})\)'.format('|'.join([str(i) for i in p_ans]))
-            logging.info(ans)
-            ans = re.compile(ans)
-
-            # mod
-            with open(candidateProgFile, 'r') as fr:
-                with open(problemDirName + '/../' + progr, 'w') as fw:
-                    wr = []
-                    for line in fr:
-                        line = line.replace('\n', '')
-                        if line.startswith('.'):
-                            if 'Rule' not in line:
-                                wr += [line]
-                        else:
-                            pat1 = r',[ \t]*Rule\(\d+\)[ \t]*\.'
-                            pat2 = r' :- Rule\(\d+\).'
-                            if not re.findall(pat1, line) and not re.findall(pat2, line):
-                                wr += [line]
-                            elif ans.search(line):
-                                if re.findall(pat1, line):
-                                    wr += [re.sub(pat1, '.', line)]
-                                else:
-                                    wr += [re.sub(pat2, '.', line)]
-                    fw.write('\n'.join(wr))
-
-            if progr == EFile.GET:
-                n_get += 1
-                mark1 = time.clock_gettime(0)
-                synthTime[0] += (mark1 - mark0[0])
-                mark0[0] = mark1
-                path = f'{problemDirName}/../..'
-                try:
-                    from synthbx.core.synthesize import p_synthesize
-                    p_synthesize(path)
-                except FileNotFoundError:
-                    if EFile.PUT not in os.listdir(f'{path}/{EFolder.SYNTH}'):
-                        yprint(f'No put could pair with get {str(s_ans)}')
-
-                    mark2 = time.clock_gettime(0)
-                    synthTime[1] += mark2 - mark1
-                    mark0[0] = mark2
-
-                    added = z3.Or([z3.BoolVal(False)] +
-                                  [z3.Not(allRuleNames[r]) for r in s_ans])
-                    if hash(added) not in [hash(c) for c in solver.assertions()]:
-                        currConstraints += 1
-                        solver.add(added)
-                        doSanity()
-                    continue
-            elif progr == EFile.PUT:
-                mark1 = time.clock_gettime(0)
-                synthTime[1] += mark1 - mark0[1]
-                mark0[1] = mark1
-            else:
-                raise Exception("Unknown progr")
+    engine = ProSynth(args.problemDirName, args.progr, argv[5:],
+                      args.setting_coprov, args.setting_delta, args.data_file)
+    result = engine.run()
+    return 1 if result.status in (UNSAT, INFEASIBLE, TIMEOUT) else 0
 
-            # logging.info(
-                # f'Calls to Z3: {callsToZ3}, Calls to Souffle: {callsToSouffle}')
-            break
-        else:
-            firstFlag = False
+
+if __name__ == '__main__':
+    sys.exit(main())
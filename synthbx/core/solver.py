@@ -0,0 +1,350 @@
+# Rule selection: a solver holds clauses over the rule names, a clause being satisfied when
+# some rule of pos is enabled or some rule of neg is disabled. Clauses are only added, a model
+# is computed once per check and kept as long as the clauses added since then satisfy it.
+# Given weights, a solver optimizes: the enabled rules of a model have a small total weight
+# instead of every unconstrained rule being enabled.
+
+
+def satisfies(model, pos, neg):
+    return any(name in model for name in pos) or any(name not in model for name in neg)
+
+
+class Solver(object):
+    """
+    Incremental rule selection under optional assumptions (name, value),
+    subclasses add clauses and find models
+    """
+
+    def __init__(self, rule_names, weights=None):
+        self.rule_names = sorted(rule_names)
+        self.weights = weights
+        self.last_model = None
+        self.checks = 0
+
+    def add_clause(self, pos=(), neg=()):
+        self.add(pos, neg)
+        if self.last_model is not None and not satisfies(self.last_model, pos, neg):
+            self.last_model = None
+
+    def check(self, assumptions=()):
+        """
+        Return whether the clauses are satisfiable, together with the assumptions
+        """
+        assumptions = list(assumptions)
+        if self.last_model is not None and \
+                all((name in self.last_model) == value for name, value in assumptions):
+            return True
+
+        self.checks += 1
+        self.last_model = self.solve(assumptions)
+        return self.last_model is not None
+
+    def model(self):
+        return set(self.last_model)
+
+    def add(self, pos, neg):
+        raise NotImplementedError
+
+    def solve(self, assumptions):
+        """
+        Enabled rules of a model, None if there is none
+        """
+        raise NotImplementedError
+
+
+class Z3Solver(Solver):
+    """
+    Rule selection by z3, passing assumptions as check literals;
+    weighted selection is solved exactly by z3 Optimize
+    """
+    name = 'z3'
+
+    def __init__(self, rule_names, weights=None):
+        import z3
+        super().__init__(rule_names, weights)
+        self.z3 = z3
+        self.vars = {name: z3.Bool(name) for name in self.rule_names}
+        if weights is None:
+            self.solver = z3.Solver()
+        else:
+            self.solver = z3.Optimize()
+            for name, var in self.vars.items():
+                self.solver.add_soft(z3.Not(var), weights.get(name, 1))
+
+    def add(self, pos, neg):
+        z3 = self.z3
+        self.solver.add(z3.Or([z3.BoolVal(False)] +
+                              [self.vars[name] for name in sorted(pos)] +
+                              [z3.Not(self.vars[name]) for name in sorted(neg)]))
+
+    def solve(self, assumptions):
+        z3 = self.z3
+        literals = [self.vars[name] if value else z3.Not(self.vars[name])
+                    for name, value in assumptions]
+        if self.solver.check(*literals) != z3.sat:
+            return None
+
+        # rules left out of the model are unconstrained, they are enabled
+        m = self.solver.model()
+        return {name for name, var in self.vars.items()
+                if m[var] is None or z3.is_true(m[var])}
+
+
+class CDCLSolver(Solver):
+    """
+    Pure-Python incremental CDCL: two watched literals, first-UIP clause learning,
+    decisions by activity with saved phases, rules enabled unless constrained.
+    Weighted selection disables rules first and minimizes the model,
+    costliest rules first, which gives a subset-minimal model rather than an optimal one.
+    Literal 2 * v (resp. 2 * v + 1) is rule v enabled (resp. disabled)
+    """
+    name = 'cdcl'
+
+    def __init__(self, rule_names, weights=None):
+        super().__init__(rule_names, weights)
+        self.vars = {name: v for v, name in enumerate(self.rule_names)}
+        n = len(self.rule_names)
+        self.value = [0] * n
+        self.level = [0] * n
+        self.reason = [None] * n
+        self.activity = [0.0] * n
+        self.phase = [1] * n
+        if weights is not None:
+            # costly rules are decided first, disabled
+            self.phase = [-1] * n
+            self.activity = [float(weights.get(name, 1)) for name in self.rule_names]
+        self.increment = 1.0
+        self.watches = {}
+        self.trail = []
+        self.trail_lim = []
+        self.qhead = 0
+        self.inconsistent = False
+        self.conflicts = 0
+
+    def literal_value(self, lit):
+        value = self.value[lit >> 1]
+        return -value if lit & 1 else value
+
+    def enqueue(self, lit, reason):
+        v = lit >> 1
+        self.value[v] = -1 if lit & 1 else 1
+        self.level[v] = len(self.trail_lim)
+        self.reason[v] = reason
+        self.trail.append(lit)
+
+    def cancel(self, level):
+        if len(self.trail_lim) <= level:
+            return
+        lim = self.trail_lim[level]
+        for lit in self.trail[lim:]:
+            v = lit >> 1
+            self.phase[v] = self.value[v]
+            self.value[v] = 0
+            self.reason[v] = None
+        del self.trail[lim:]
+        del self.trail_lim[level:]
+        self.qhead = min(self.qhead, lim)
+
+    def attach(self, clause):
+        self.watches.setdefault(clause[0], []).append(clause)
+        self.watches.setdefault(clause[1], []).append(clause)
+
+    def add(self, pos, neg):
+        if self.inconsistent:
+            return
+        self.cancel(0)
+
+        lits = {2 * self.vars[name] for name in pos} | \
+            {2 * self.vars[name] + 1 for name in neg}
+        if any(lit ^ 1 in lits for lit in lits) or \
+                any(self.literal_value(lit) == 1 for lit in lits):
+            return
+
+        clause = sorted(lit for lit in lits if self.literal_value(lit) == 0)
+        if not clause:
+            self.inconsistent = True
+        elif len(clause) == 1:
+            self.enqueue(clause[0], None)
+            if self.propagate() is not None:
+                self.inconsistent = True
+        else:
+            self.attach(clause)
+
+    def propagate(self):
+        """
+        Propagate the trail, return a conflicting clause or None
+        """
+        while self.qhead < len(self.trail):
+            false_lit = self.trail[self.qhead] ^ 1
+            self.qhead += 1
+            watching = self.watches.get(false_lit, [])
+            kept = []
+            self.watches[false_lit] = kept
+
+            for i, clause in enumerate(watching):
+                if clause[0] == false_lit:
+                    clause[0], clause[1] = clause[1], clause[0]
+                if self.literal_value(clause[0]) == 1:
+                    kept.append(clause)
+                    continue
+
+                for k in range(2, len(clause)):
+                    if self.literal_value(clause[k]) != -1:
+                        clause[1], clause[k] = clause[k], clause[1]
+                        self.watches.setdefault(clause[1], []).append(clause)
+                        break
+                else:
+                    kept.append(clause)
+                    if self.literal_value(clause[0]) == -1:
+                        kept.extend(watching[i + 1:])
+                        self.qhead = len(self.trail)
+                        return clause
+                    self.enqueue(clause[0], clause)
+        return None
+
+    def bump(self, v):
+        self.activity[v] += self.increment
+        if self.activity[v] > 1e100:
+            self.activity = [a * 1e-100 for a in self.activity]
+            self.increment *= 1e-100
+
+    def analyze(self, conflict):
+        """
+        First-UIP clause learned from conflict, asserting literal first, and its backjump level
+        """
+        current = len(self.trail_lim)
+        seen = set()
+        learnt = [None]
+        pending = 0
+        lit = None
+        i = len(self.trail) - 1
+        clause = conflict
+
+        while True:
+            for q in (clause if lit is None else clause[1:]):
+                v = q >> 1
+                if v not in seen and self.level[v] > 0:
+                    seen.add(v)
+                    self.bump(v)
+                    if self.level[v] == current:
+                        pending += 1
+                    else:
+                        learnt.append(q)
+            while self.trail[i] >> 1 not in seen:
+                i -= 1
+            lit = self.trail[i]
+            i -= 1
+            clause = self.reason[lit >> 1]
+            pending -= 1
+            if pending == 0:
+                break
+
+        learnt[0] = lit ^ 1
+        if len(learnt) == 1:
+            return learnt, 0
+        top = max(range(1, len(learnt)), key=lambda k: self.level[learnt[k] >> 1])
+        learnt[1], learnt[top] = learnt[top], learnt[1]
+        return learnt, self.level[learnt[1] >> 1]
+
+    def decide(self):
+        best = None
+        for v, value in enumerate(self.value):
+            if value == 0 and (best is None or self.activity[v] > self.activity[best]):
+                best = v
+        return best
+
+    def solve(self, assumptions):
+        model = self.search(assumptions)
+        if model is None or self.weights is None:
+            return model
+
+        for name in sorted(model, key=lambda name: -self.weights.get(name, 1)):
+            if name not in model:
+                continue
+            fixed = [(other, False) for other in self.rule_names if other not in model]
+            smaller = self.search(assumptions + fixed + [(name, False)])
+            if smaller is not None:
+                model = smaller
+        return model
+
+    def search(self, assumptions):
+        if self.inconsistent:
+            return None
+        self.cancel(0)
+        assumed = [2 * self.vars[name] + (0 if value else 1) for name, value in assumptions]
+
+        while True:
+            conflict = self.propagate()
+            if conflict is not None:
+                self.conflicts += 1
+                if not self.trail_lim:
+                    self.inconsistent = True
+                    return None
+                learnt, level = self.analyze(conflict)
+                self.cancel(level)
+                if len(learnt) > 1:
+                    self.attach(learnt)
+                    self.enqueue(learnt[0], learnt)
+                else:
+                    self.enqueue(learnt[0], None)
+                self.increment /= 0.95
+                continue
+
+            if len(self.trail_lim) < len(assumed):
+                lit = assumed[len(self.trail_lim)]
+                if self.literal_value(lit) == -1:
+                    return None
+                self.trail_lim.append(len(self.trail))
+                if self.literal_value(lit) == 0:
+                    self.enqueue(lit, None)
+                continue
+
+            v = self.decide()
+            if v is None:
+                return {name for name, v in self.vars.items() if self.value[v] == 1}
+            self.trail_lim.append(len(self.trail))
+            self.enqueue(2 * v + (0 if self.phase[v] == 1 else 1), None)
+
+
+SOLVERS = {
+    'cdcl': CDCLSolver,
+    'z3': Z3Solver,
+}
+
+
+def unsat_core(rule_names, clauses):
+    """
+    Indexes of a subset-minimal unsatisfiable subset of clauses (pos, neg), by deletion of chunks
+    halved down to single clauses; None if the clauses are satisfiable
+    """
+    def satisfiable(indexes):
+        solver = CDCLSolver(rule_names)
+        for i in indexes:
+            solver.add_clause(*clauses[i])
+        return solver.check()
+
+    core = list(range(len(clauses)))
+    if satisfiable(core):
+        return None
+
+    chunk = max(1, len(core) // 2)
+    while True:
+        i = 0
+        while i < len(core):
+            rest = core[:i] + core[i + chunk:]
+            if satisfiable(rest):
+                i += chunk
+            else:
+                core = rest
+        if chunk == 1:
+            return core
+        chunk //= 2
+
+
+def make_solver(kind, rule_names, weights=None):
+    """
+    Solver of kind; 'auto' is the built-in CDCL solver, every constraint being a clause
+    """
+    if kind == 'auto':
+        kind = 'cdcl'
+    return SOLVERS[kind](rule_names, weights)
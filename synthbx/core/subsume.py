@@ -0,0 +1,120 @@
+from synthbx.core.datalog import compare
+from synthbx.core.materialize import selectors
+
+
+# A clause a subsumes a clause b when a substitution of the variables of a maps its head to
+# the head of b and its body into the body of b: every tuple b derives, a derives it too.
+# Enabling b along with a never changes the outputs, and b is useless if they are equivalent.
+
+
+def normalize(clause, prefix):
+    """
+    Head and body literals of clause with variables bound by equalities replaced by their constant,
+    anonymous variables renamed apart, Rule literals left out
+    """
+    binding = clause.binding
+    fresh = iter(range(1 << 30))
+
+    def args_of(args):
+        ans = []
+        for is_var, v in args:
+            if not is_var:
+                ans.append((False, v))
+            elif v is None:
+                ans.append((True, f'{prefix}_{next(fresh)}'))
+            elif v in binding:
+                ans.append((False, binding[v]))
+            else:
+                ans.append((True, f'{prefix}{v}'))
+        return tuple(ans)
+
+    head = (clause.head[0], args_of(clause.head[1]))
+    literals = [(True, name, args_of(args))
+                for name, args in clause.atoms if name != 'Rule']
+    literals += [(False, name, args_of(args))
+                 for name, args in clause.negations if name != 'Rule']
+    checks = [(cmp, args_of([(True, v)])[0], value) for cmp, v, value in clause.checks]
+    return head, literals, checks
+
+
+def unify(args, target, theta):
+    """
+    Extend theta so that args maps to target, None if impossible
+    """
+    theta = dict(theta)
+    for (is_var, v), term in zip(args, target):
+        if not is_var:
+            if term != (False, v):
+                return None
+        elif theta.setdefault(v, term) != term:
+            return None
+    return theta
+
+
+def subsumes(a, b):
+    if a.binding is None or b.binding is None:
+        return False
+
+    head_a, literals_a, checks_a = normalize(a, 'a')
+    head_b, literals_b, checks_b = normalize(b, 'b')
+    if head_a[0] != head_b[0] or len(head_a[1]) != len(head_b[1]):
+        return False
+
+    theta = unify(head_a[1], head_b[1], {})
+    if theta is None:
+        return False
+
+    # literals of a are mapped one at a time, backtracking by an explicit stack of choices
+    stack = [(0, theta)]
+    while stack:
+        i, theta = stack.pop()
+        if i == len(literals_a):
+            if all(holds(cmp, theta.get(v[1], v) if v[0] else v, value, checks_b)
+                   for cmp, v, value in checks_a):
+                return True
+            continue
+        positive, name, args = literals_a[i]
+        for other in literals_b:
+            if other[0] == positive and other[1] == name and len(other[2]) == len(args):
+                extended = unify(args, other[2], theta)
+                if extended is not None:
+                    stack.append((i + 1, extended))
+    return False
+
+
+def holds(cmp, term, value, checks):
+    is_var, v = term
+    if not is_var:
+        return compare(cmp, v, value)
+    return (cmp, term, value) in checks
+
+
+def structural_clauses(datalog, rule_names):
+    """
+    Clauses (pos, neg) over rule_names from subsumption between the clauses they select:
+    at most one of a rule and a rule it subsumes, only the first rule of equivalent ones
+    """
+    clauses = {}
+    for c in datalog.clauses:
+        names = selectors(c)
+        if names is not None and len(names) == 1 and names <= set(rule_names):
+            name = next(iter(names))
+            # a rule selecting several clauses is left out
+            clauses[name] = None if name in clauses else c
+    clauses = {name: c for name, c in clauses.items() if c is not None}
+
+    ans = []
+    disabled = set()
+    names = sorted(clauses)
+    for i, x in enumerate(names):
+        for y in names[i + 1:]:
+            x_y = subsumes(clauses[x], clauses[y])
+            y_x = subsumes(clauses[y], clauses[x])
+            if x_y and y_x:
+                if x not in disabled:
+                    disabled.add(y)
+            elif x_y or y_x:
+                ans.append(((), {x, y}))
+
+    ans += [((), {name}) for name in sorted(disabled)]
+    return ans
@@ -1,7 +1,14 @@
 import os
+import re
 import sys
+import copy
 import shutil
 import random
+import tempfile
+import time
+import multiprocessing
+import multiprocessing.connection
+import signal
 from synthbx.parser.schema.parser import parse_schema
 from synthbx.parser.program.parser import parse_program
 from synthbx.parser.example.parser import parse_example
@@ -9,20 +16,29 @@ from synthbx.core.decompose import decompose
 from synthbx.core.gcandidate import gen_get_cand
 from synthbx.core.pcandidate import build_put_cand
 from synthbx.core.fexample import upgrade_to_fexample
+from synthbx.core.evaluator import evaluate_outputs, write_relation
+from synthbx.core.constraints import CHECKPOINT_FOLDER, CLAUSE_FOLDER
+from synthbx.core.prosynth import ProSynth, parse_settings
 import synthbx.core.handler as handler
 from synthbx.env.const import EFile, EFolder, ESynth, ESuffix, EPrefix, EExt, ESymbol
 from synthbx.env.exception import SpecificationError
 from synthbx.util.io import get_ext_files
 
 
+# output of a portfolio run, kept in the synth folder of the winning one
+PORTFOLIO_LOG = 'portfolio.log'
+
+
 # flow:
-#   synthesize
-#   +-- os.system (prosynth get)
+#   synthesize / enumerate_pairs (every pair, one at a time)
+#   +-- ProSynth (get)
 #        +--- p_synthesize
-#             +---- os.system (prosynth put)
+#             +---- ProSynth (put)
+#        +--- PutPool (with put jobs: p_synthesize per get in a background process)
+#   portfolio (with runs: synthesize per seed in a copy of the specification)
 
 
-def synthesize(path):
+def synthesize(path, options=()):
     sc_path = f'{path}/{EFolder.SCHEMA}'
     ex_path = f'{path}/{EFolder.EXAMPLE}'
     sy_path = f'{path}/{EFolder.SYNTH}'
@@ -33,9 +49,7 @@ def synthesize(path):
 
     ex_path_get = move_g_ex2sy(ex_path, sy_path, schema_partition, example)
 
-    os.system(
-        f'python {ESynth.PROSYNTH_PY} {ex_path_get} 0 1 /dev/null {EFile.GET}'
-    )
+    result = ProSynth(ex_path_get, EFile.GET, options).run()
 
     # write candidates & results after finishing synthesis
     # no effect on synthesis time
@@ -58,14 +72,144 @@ def synthesize(path):
         with open(f'{re_path}/{EFile.DGET}', 'w') as fw:
             fw.write(str(prog_d_get))
 
-
-def p_synthesize(path):
+    return result
+
+
+def dget_key(dget):
+    """
+    Text of a decomposed get with the relations invented by decompose renamed in order of appearance,
+    the same for decompositions of the same get
+    """
+    names = {}
+    text = re.sub(rf'{re.escape(EPrefix.MIDDLE_REL)}\d+',
+                  lambda m: names.setdefault(m.group(0), f'{EPrefix.MIDDLE_REL}{len(names)}'),
+                  dget)
+    return '\n'.join(sorted(text.splitlines()))
+
+
+def enumerate_pairs(path, options=(), limit=None, key=dget_key):
+    """
+    Generate the pairs of get and put of the specification at path as they are found,
+    as (get, put, stats) with the texts of the programs and the counters of the get search,
+    at most limit of them; a pair whose decomposed get has the key of an earlier one is skipped.
+    One get search runs throughout, every found get excluded by a clause along with the clauses
+    learned so far
+    """
     sc_path = f'{path}/{EFolder.SCHEMA}'
     ex_path = f'{path}/{EFolder.EXAMPLE}'
     sy_path = f'{path}/{EFolder.SYNTH}'
 
     schema, example = parse_specification(sc_path, ex_path)
 
+    ex_path_get = move_g_ex2sy(ex_path, sy_path, schema.partition(), example)
+
+    if limit is not None and limit <= 0:
+        return
+
+    results = ProSynth(ex_path_get, EFile.GET, options).results()
+    keys = set()
+    try:
+        for result in results:
+            if not result:
+                return
+
+            programs = []
+            for f in [EFile.GET, EFile.DGET, EFile.PUT]:
+                with open(f'{sy_path}/{f}', 'r') as fr:
+                    programs.append(fr.read())
+            get, dget, put = programs
+
+            k = key(dget)
+            if k in keys:
+                continue
+            keys.add(k)
+            yield get, put, copy.deepcopy(result.counters)
+            if limit is not None and len(keys) >= limit:
+                return
+    finally:
+        results.close()
+
+
+def portfolio_worker(workspace, options, seed):
+    # a process group of its own, so that the run is killed along with its put processes
+    os.setpgrp()
+    with open(f'{workspace}/{PORTFOLIO_LOG}', 'w') as fw:
+        os.dup2(fw.fileno(), sys.stdout.fileno())
+        os.dup2(fw.fileno(), sys.stderr.fileno())
+    random.seed(seed)
+    sys.exit(0 if synthesize(workspace, options) else 1)
+
+
+def portfolio(path, options, runs, configs=()):
+    """
+    Race runs syntheses of the specification at path, each seeded by its index in a copy of
+    the specification, run i adding the options configs[i % len(configs)]; the synth and result
+    folders of the first run pairing a get with a put replace those of path, the others are killed.
+    Return the index of the winning run, None if every run failed
+    """
+    path = os.path.abspath(path)
+    sy_path = f'{path}/{EFolder.SYNTH}'
+    root = tempfile.mkdtemp(prefix='.portfolio', dir=os.path.dirname(path))
+
+    running = {}
+    start = time.time()
+    for i in range(runs):
+        workspace = f'{root}/{i}'
+        shutil.copytree(path, workspace,
+                        ignore=shutil.ignore_patterns(EFolder.SYNTH, EFolder.RESULT))
+        if os.path.exists(f'{sy_path}/{CLAUSE_FOLDER}'):
+            shutil.copytree(f'{sy_path}/{CLAUSE_FOLDER}',
+                            f'{workspace}/{EFolder.SYNTH}/{CLAUSE_FOLDER}')
+
+        run_options = list(options) + (list(configs[i % len(configs)]) if configs else [])
+        # pending output would be written again by every forked run
+        sys.stdout.flush()
+        sys.stderr.flush()
+        process = multiprocessing.Process(
+            target=portfolio_worker, args=(workspace, run_options, i))
+        process.start()
+        running[process.sentinel] = (i, process, run_options)
+
+    winner = None
+    try:
+        while running and winner is None:
+            for sentinel in multiprocessing.connection.wait(list(running)):
+                i, process, run_options = running.pop(sentinel)
+                process.join()
+                status = 'solved' if process.exitcode == 0 else 'failed'
+                print(f'[+] Portfolio run {i} {run_options}: {status} '
+                      f'after {time.time() - start:.2f}s')
+                if process.exitcode == 0 and winner is None:
+                    winner = i
+    finally:
+        for i, process, _ in running.values():
+            try:
+                os.killpg(process.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+            process.join()
+            print(f'[+] Portfolio run {i}: killed')
+
+    if winner is not None:
+        for folder in [EFolder.SYNTH, EFolder.RESULT]:
+            if os.path.exists(f'{path}/{folder}'):
+                shutil.rmtree(f'{path}/{folder}')
+            if os.path.exists(f'{root}/{winner}/{folder}'):
+                shutil.move(f'{root}/{winner}/{folder}', f'{path}/{folder}')
+        os.makedirs(sy_path, exist_ok=True)
+        shutil.move(f'{root}/{winner}/{PORTFOLIO_LOG}', f'{sy_path}/{PORTFOLIO_LOG}')
+
+    shutil.rmtree(root, ignore_errors=True)
+    return winner
+
+
+def p_synthesize(path, options=(), sy_path=None):
+    sc_path = f'{path}/{EFolder.SCHEMA}'
+    ex_path = f'{path}/{EFolder.EXAMPLE}'
+    sy_path = sy_path or f'{path}/{EFolder.SYNTH}'
+
+    schema, example = parse_specification(sc_path, ex_path)
+
     schema_partition = schema.partition()
 
     with open(f'{sy_path}/{EFile.GET}', 'r') as fr:
@@ -76,7 +220,8 @@ def p_synthesize(path):
     with open(f'{sy_path}/{EFile.DGET}', 'w') as fw:
         fw.write(str(prog_d_get))
 
-    ex_path_put = move_and_gen_p_ex2sy(ex_path, sy_path, schema_partition)
+    ex_path_put = move_and_gen_p_ex2sy(ex_path, sy_path, schema_partition,
+                                       parse_settings(options).output_io)
 
     upgrade_to_fexample(
         example, schema_partition, prog_d_get.relation_decls, ex_path_put
@@ -100,9 +245,9 @@ def p_synthesize(path):
         for i in random.sample(list(range(num_c_rules)), num_c_rules):
             fw.write(str(i) + '\n')
 
-    os.system(
-        f'python {ESynth.PROSYNTH_PY} {ex_path_put} 0 1 /dev/null {EFile.PUT}'
-    )
+    result = ProSynth(ex_path_put, EFile.PUT, options).run()
+    if not result:
+        return result
 
     with open(f'{sy_path}/{EFile.PUT}', 'r') as fr:
         prog_put = parse_program(fr.read())
@@ -113,6 +258,95 @@ def p_synthesize(path):
     with open(f'{sy_path}/{EFile.PUT}', 'w') as fw:
         fw.write(str(prog_put))
 
+    return result
+
+
+def put_worker(path, options, sy_path):
+    sys.exit(0 if p_synthesize(path, options, sy_path) else 1)
+
+
+class PutPool(object):
+    """
+    Put synthesis of found gets in background processes, at most jobs at a time,
+    every get in its own workspace under the synth folder so that their files never clash
+    """
+
+    def __init__(self, path, options, jobs):
+        self.path = path
+        self.options = options
+        self.jobs = jobs
+        self.sy_path = f'{path}/{EFolder.SYNTH}'
+        self.pending = []
+        self.running = {}
+
+    def __len__(self):
+        return len(self.pending) + len(self.running)
+
+    def submit(self, rules):
+        # the get just written to the synth folder is copied before the next one overwrites it
+        workspace = tempfile.mkdtemp(prefix='put', dir=self.sy_path)
+        shutil.copy(f'{self.sy_path}/{EFile.GET}', workspace)
+        self.pending.append((rules, workspace))
+        self.start()
+
+    def queued(self):
+        """
+        Gets waiting for their put or in put synthesis
+        """
+        return [rules for rules, _ in self.pending] + \
+            [rules for rules, _, _ in self.running.values()]
+
+    def start(self):
+        while self.pending and len(self.running) < self.jobs:
+            rules, workspace = self.pending.pop(0)
+            process = multiprocessing.Process(
+                target=put_worker, args=(self.path, self.options, workspace))
+            process.start()
+            self.running[workspace] = (rules, process, time.time())
+
+    def poll(self, block=False):
+        """
+        Gets whose put synthesis ended, as (rules, workspace, paired, seconds);
+        with block, wait until one ends unless none is left
+        """
+        if block and self.running and \
+                not any(process.exitcode is not None for _, process, _ in self.running.values()):
+            multiprocessing.connection.wait(
+                [process.sentinel for _, process, _ in self.running.values()])
+
+        ans = []
+        for workspace, (rules, process, start) in list(self.running.items()):
+            if process.exitcode is None:
+                continue
+            process.join()
+            del self.running[workspace]
+            paired = process.exitcode == 0
+            if not paired:
+                shutil.rmtree(workspace, ignore_errors=True)
+            ans.append((rules, workspace, paired, time.time() - start))
+
+        self.start()
+        return ans
+
+    def install(self, workspace):
+        """
+        Move the programs of a paired get and put from its workspace to the synth folder
+        """
+        for f in [EFile.GET, EFile.DGET, EFile.CPUT, EFile.PUT]:
+            shutil.copy(f'{workspace}/{f}', f'{self.sy_path}/{f}')
+        shutil.rmtree(workspace, ignore_errors=True)
+
+    def cancel(self):
+        for _, process, _ in self.running.values():
+            process.terminate()
+        for workspace, (_, process, _) in list(self.running.items()):
+            process.join()
+            shutil.rmtree(workspace, ignore_errors=True)
+        for _, workspace in self.pending:
+            shutil.rmtree(workspace, ignore_errors=True)
+        self.running = {}
+        self.pending = []
+
 
 def parse_specification(sc_path, ex_path):
     schema, example = None, None
@@ -143,7 +377,15 @@ def parse_specification(sc_path, ex_path):
 
 def move_g_ex2sy(ex_path, sy_path, schema_partition, example):
     if os.path.exists(sy_path):
-        shutil.rmtree(sy_path)
+        # learned clauses are kept for warm starts, keyed by the content of their inputs,
+        # and the checkpoint of an unfinished search for its resumption
+        for f in os.listdir(sy_path):
+            if f in [CLAUSE_FOLDER, CHECKPOINT_FOLDER]:
+                continue
+            if os.path.isdir(f'{sy_path}/{f}'):
+                shutil.rmtree(f'{sy_path}/{f}')
+            else:
+                os.remove(f'{sy_path}/{f}')
 
     ex_path_get = f'{sy_path}/{EFolder.GET}'
 
@@ -188,7 +430,7 @@ def move_g_ex2sy(ex_path, sy_path, schema_partition, example):
     return ex_path_get
 
 
-def move_and_gen_p_ex2sy(ex_path, sy_path, schema_partition):
+def move_and_gen_p_ex2sy(ex_path, sy_path, schema_partition, io='files'):
     ex_path_put = f'{sy_path}/{EFolder.PUT}'
 
     if os.path.exists(ex_path_put):
@@ -198,15 +440,17 @@ def move_and_gen_p_ex2sy(ex_path, sy_path, schema_partition):
 
     source, view, _ = schema_partition
 
+    # outputs of dget, read from CSV files or from stdout (io 'memory'),
+    # are written once under their final names
+    dget = f'{sy_path}/{EFile.DGET}'
+
     # move (source_update.EXPT) files to ex_path_put WITH renaming to (source.FACT)
     # call SOUFFLE_EXE to evaluate dget to gen backward tables then renaming to _update
     for s in source:
         shutil.copy(f'{ex_path}/{s.name}{ESuffix.UPDATE}{EExt.EXPT}',
                     f'{ex_path_put}/{s.name}{EExt.FACT}')
 
-    os.system(
-        f'{ESynth.SOUFFLE_EXE} -w -F {ex_path_put} -D {ex_path_put} {sy_path}/{EFile.DGET}'
-    )
+    outputs = evaluate_outputs(ex_path_put, dget, io)
 
     for f in os.listdir(ex_path_put):
         if f.endswith(EExt.FACT):
@@ -214,11 +458,10 @@ def move_and_gen_p_ex2sy(ex_path, sy_path, schema_partition):
                 ESuffix.UPDATE + EExt.EXPT
             os.rename(f'{ex_path_put}/{f}',
                       f'{ex_path_put}/{nf}')
-        elif f.endswith(EExt.CSV):
-            nf = f[:-len(EExt.CSV)] + \
-                ESuffix.UPDATE + EExt.EXPT
-            os.rename(f'{ex_path_put}/{f}',
-                      f'{ex_path_put}/{nf}')
+
+    for name, tuples in outputs.items():
+        write_relation(
+            f'{ex_path_put}/{name}{ESuffix.UPDATE}{EExt.EXPT}', tuples)
 
     for v in view:
         os.rename(f'{ex_path_put}/{v.name}{ESuffix.UPDATE}{EExt.EXPT}',
@@ -230,15 +473,8 @@ def move_and_gen_p_ex2sy(ex_path, sy_path, schema_partition):
         shutil.copy(f'{ex_path}/{s.name}{EExt.FACT}',
                     f'{ex_path_put}/{s.name}{EExt.FACT}')
 
-    os.system(
-        f'{ESynth.SOUFFLE_EXE} -w -F {ex_path_put} -D {ex_path_put} {sy_path}/{EFile.DGET}'
-    )
-
-    for f in os.listdir(ex_path_put):
-        if f.endswith(EExt.CSV):
-            nf = f[:-len(EExt.CSV)] + EExt.EXPT
-            os.rename(f'{ex_path_put}/{f}',
-                      f'{ex_path_put}/{nf}')
+    for name, tuples in evaluate_outputs(ex_path_put, dget, io).items():
+        write_relation(f'{ex_path_put}/{name}{EExt.EXPT}', tuples)
 
     return ex_path_put
 
@@ -0,0 +1,41 @@
+import os
+import shutil
+
+import pytest
+
+from synthbx.core.synthesize import parse_specification, move_g_ex2sy
+from synthbx.env.const import EFolder, ESynth
+
+
+BENCHMARKS = os.path.join(os.path.dirname(__file__), '..', '..', '..', 'benchmarks', 'data', 'popl-20')
+
+BACKENDS = [
+    'python',
+    pytest.param('souffle', marks=pytest.mark.skipif(
+        shutil.which(ESynth.SOUFFLE_EXE) is None, reason='souffle is not installed')),
+]
+
+
+@pytest.fixture
+def spec(tmp_path):
+    """
+    Copy of a popl-20 specification in tmp_path, under the folder dest if given
+    """
+    def copy(name, dest=None):
+        path = str(tmp_path / (dest or name))
+        shutil.copytree(os.path.join(BENCHMARKS, name), path)
+        return path
+    return copy
+
+
+@pytest.fixture
+def get_problem(spec):
+    """
+    Problem folder of the synthesis of get of a popl-20 specification, as written by synthesize
+    """
+    def make(name, dest=None):
+        path = spec(name, dest)
+        ex_path = f'{path}/{EFolder.EXAMPLE}'
+        schema, example = parse_specification(f'{path}/{EFolder.SCHEMA}', ex_path)
+        return move_g_ex2sy(ex_path, f'{path}/{EFolder.SYNTH}', schema.partition(), example)
+    return make
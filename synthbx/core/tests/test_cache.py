@@ -0,0 +1,77 @@
+from synthbx.core.cache import EvaluationCache, LRUCache, ProvenanceCache
+from synthbx.core.datalog import Datalog
+from synthbx.core.evaluator import proof_rules
+from synthbx.core.materialize import dependency_cones
+from synthbx.parser.program.parser import parse_program
+
+
+PROGRAM = '''
+.decl Rule(v0: number)
+.input Rule
+
+.decl edge(v0: number, v1: number)
+.input edge
+
+.decl path(v0: number, v1: number)
+.output path
+.decl loop(v0: number)
+.output loop
+
+edge(1, 2). edge(2, 3). edge(3, 1). edge(3, 4).
+
+path(v0, v1) :- edge(v0, v1), Rule(0).
+path(v0, v2) :- path(v0, v1), edge(v1, v2), Rule(1).
+path(v0, v2) :- edge(v0, v1), path(v1, v2), Rule(2).
+loop(v0) :- path(v0, v0), Rule(3).
+loop(v0) :- edge(v0, v1), edge(v1, v0), Rule(4).
+'''
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert 'b' not in cache and 'a' in cache and 'c' in cache
+    assert cache.get('b') is None
+    assert (cache.hits, cache.misses, cache.evictions, len(cache)) == (1, 1, 1, 2)
+
+
+def test_lru_of_capacity_zero_stores_nothing():
+    cache = LRUCache(0)
+    cache.put('a', 1)
+    assert len(cache) == 0 and cache.get('a', 'none') == 'none'
+
+
+def test_evaluation_key_follows_rule_set_and_facts(get_problem):
+    problem = get_problem('sql-05')
+    cache = EvaluationCache(8, problem)
+    assert cache.key(['8', '6']) == cache.key({'6', '8'})
+    assert cache.key(['8']) != cache.key(['6'])
+
+    with open(f'{problem}/input2.facts', 'a') as fw:
+        fw.write('99\tpart99\n')
+    assert EvaluationCache(8, problem).key(['8']) != cache.key(['8'])
+
+
+def test_provenance_key_ignores_rules_outside_the_cone():
+    # tuples of two rule sets with the same key are derived alike, their proofs use the same rules
+    datalog = Datalog(parse_program(PROGRAM))
+    _, cones = dependency_cones(datalog)
+    assert cones['path'] == {'0', '1', '2'}
+    cache = ProvenanceCache(1 << 16, cones)
+
+    compared = 0
+    for n in range(1 << 5):
+        rule_set = {str(r) for r in range(5) if n >> r & 1}
+        evaluation = datalog.evaluate(rule_set, provenance=True)
+        for rel_name in ['path', 'loop']:
+            for t in evaluation.relations[rel_name]:
+                rules = proof_rules(evaluation.explain(rel_name, t), lambda *_: False)
+                key = cache.key(rel_name, t, rule_set)
+                if key in cache:
+                    assert cache.get(key) == rules
+                    compared += 1
+                cache.put(key, rules)
+    assert compared
@@ -0,0 +1,29 @@
+from synthbx.core.constraints import ConstraintStore
+
+
+def test_saved_clauses_keep_their_reasons_and_leave_local_ones_out(tmp_path):
+    filename = str(tmp_path / 'clauses.json')
+    store = ConstraintStore(['0', '1', '2'])
+    store.add_clause(neg={'0'}, reason="ans('a',) is undesirable and produced")
+    store.add_clause(pos={'1', '2'}, reason="ans('b',) is desirable and unproduced")
+    store.add_clause(neg={'0', '1'}, reason='the candidate was already visited', local=True)
+    store.save(filename)
+
+    reloaded = ConstraintStore(['0', '1', '2'])
+    assert sorted(map(str, reloaded.load(filename))) == \
+        sorted(map(str, [([], ['0']), (['1', '2'], [])]))
+    assert [reason for _, _, reason in reloaded.explained_clauses()] == [
+        "ans('a',) is undesirable and produced, learned by an earlier run",
+        "ans('b',) is desirable and unproduced, learned by an earlier run",
+    ]
+    # nothing new to add from the same file
+    assert reloaded.load(filename) == []
+
+
+def test_visited_and_solutions_are_deduplicated():
+    store = ConstraintStore(['0', '1'])
+    store.visit({'0'})
+    assert store.is_visited({'0'}) and not store.is_visited({'0', '1'})
+    assert store.add_solution({'1'}) and not store.add_solution({'1'})
+    assert store.add_clause(neg={'1'}) and not store.add_clause(neg={'1'})
+    assert store.duplicates == 1
@@ -0,0 +1,121 @@
+import itertools
+
+import pytest
+
+from synthbx.core.datalog import Datalog, DatalogBackend
+from synthbx.core.evaluator import load_relation, proof_rules
+from synthbx.parser.program.parser import parse_program
+from synthbx.env.const import ESynth
+
+
+PROGRAM = '''
+.type node
+
+.decl Rule(v0: number)
+.input Rule
+
+.decl edge(v0: node, v1: node)
+.input edge
+.decl vertex(v0: node)
+.input vertex
+
+.decl path(v0: node, v1: node)
+.output path
+.decl cut(v0: node, v1: node)
+.output cut
+
+path(v0, v1) :- edge(v0, v1), Rule(0).
+path(v0, v2) :- path(v0, v1), edge(v1, v2), Rule(1).
+path(v0, v0) :- vertex(v0), Rule(2).
+cut(v0, v1) :- vertex(v0), vertex(v1), !path(v0, v1), Rule(3).
+'''
+
+EDGES = {('a', 'b'), ('b', 'c'), ('c', 'b'), ('d', 'a')}
+VERTICES = {('a',), ('b',), ('c',), ('d',), ('e',)}
+
+
+def reference(rule_set):
+    """
+    Relations of PROGRAM under rule_set, by a naive fixpoint
+    """
+    path = set()
+    while True:
+        new = set()
+        if '0' in rule_set:
+            new |= EDGES
+        if '1' in rule_set:
+            new |= {(x, z) for x, y in path for y2, z in EDGES if y == y2}
+        if '2' in rule_set:
+            new |= {(x, x) for x, in VERTICES}
+        if new <= path:
+            break
+        path |= new
+    cut = set()
+    if '3' in rule_set:
+        cut = {(x, y) for x, in VERTICES for y, in VERTICES if (x, y) not in path}
+    return {'path': path, 'cut': cut}
+
+
+@pytest.fixture
+def datalog(tmp_path):
+    (tmp_path / 'edge.facts').write_text(''.join(f'{x}\t{y}\n' for x, y in sorted(EDGES)))
+    (tmp_path / 'vertex.facts').write_text(''.join(f'{x}\n' for x, in sorted(VERTICES)))
+    return Datalog(parse_program(PROGRAM), str(tmp_path))
+
+
+def rule_sets():
+    names = ['0', '1', '2', '3']
+    for n in range(len(names) + 1):
+        for rule_set in itertools.combinations(names, n):
+            yield set(rule_set)
+
+
+def test_evaluate_matches_naive_fixpoint(datalog):
+    for rule_set in rule_sets():
+        expected = reference(rule_set)
+        relations = datalog.evaluate(rule_set).relations
+        for name in expected:
+            assert relations[name] == expected[name], (rule_set, name)
+
+
+def test_explain_uses_enabled_rules(datalog):
+    for rule_set in rule_sets():
+        evaluation = datalog.evaluate(rule_set, provenance=True)
+        for name in ['path', 'cut']:
+            for t in evaluation.relations[name]:
+                used = proof_rules(evaluation.explain(name, t), lambda *_: False)
+                assert used and used <= rule_set, (rule_set, name, t)
+        assert proof_rules(evaluation.explain('path', ('e', 'a')), lambda *_: False) is None
+
+
+def test_coprovenance_meets_every_producing_rule_set(datalog):
+    # a rule set lacking a tuple of path, which no negation reaches, only gains it by enabling
+    # a rule of its co-provenance
+    targets = [('path', t) for t in reference({'0', '1', '2'})['path']]
+    coprovenance = datalog.coprovenance({'0', '1', '2', '3'}, targets)
+    produced = {frozenset(rule_set): datalog.evaluate(rule_set).relations['path'] for rule_set in rule_sets()}
+    for name, t in targets:
+        for lacking, ts in produced.items():
+            if t in ts:
+                continue
+            for rule_set, us in produced.items():
+                if t in us:
+                    assert (rule_set - lacking) & coprovenance[(name, t)], (t, lacking, rule_set)
+
+
+def test_negation_in_recursion_is_rejected():
+    program = PROGRAM + 'path(v0, v1) :- cut(v0, v1), Rule(4).\n'
+    with pytest.raises(ValueError, match='not stratifiable'):
+        Datalog(parse_program(program))
+
+
+def test_backend_on_candidate_program(get_problem):
+    problem = get_problem('sql-05')
+    backend = DatalogBackend(problem, f'{problem}/{ESynth.CANDIDATE_RULE_DL}', ['ans'])
+    # rule 8 alone is a solution of sql-05, nothing is produced without rules
+    assert backend.evaluate({'8'})['ans'] == load_relation(f'{problem}/ans.expected')
+    assert backend.evaluate(set()) == {'ans': set()}
+    with backend.session({'8'}) as session:
+        assert session.outputs['ans']
+        for t in session.outputs['ans']:
+            assert proof_rules(session.explain('ans', t), lambda *_: False) == {'8'}
@@ -0,0 +1,222 @@
+import json
+import os
+import random
+import stat
+
+import pytest
+
+from synthbx.core import evaluator
+from synthbx.core.datalog import DatalogBackend
+from synthbx.core.evaluator import SouffleBackend, SouffleError, TieredSession, compile_program, evaluate_outputs, \
+    proof_rules, text_tokens, tree_tokens
+from synthbx.core.prosynth import ProSynth, SOLVED
+from synthbx.core.tests.conftest import BACKENDS
+from synthbx.env.const import EFile, ESynth
+
+
+# reply of souffle to explain in json format, spaces before the closing braces
+SOUFFLE_PROOF = '''{ "proof":
+{ "premises": "ans(\\"PN1\\")", "rule-number": "(R2)",
+"children": [
+{ "premises": "mid(\\"P1\\", \\"PN1\\")", "rule-number": "(R5)",
+"children": [
+{ "axiom": "input2(\\"P1\\", \\"PN1\\")" },
+{ "axiom": "Rule(3)" } ] },
+{ "axiom": "Rule(6)" } ] } }
+'''
+
+
+def executable(path, script):
+    path.write_text('#!/bin/sh\n' + script)
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    return str(path)
+
+
+def fake_souffle(tmp_path, monkeypatch, script):
+    """
+    Make souffle an executable running the shell script, with the output directory (-D) as $out
+    """
+    exe = executable(tmp_path / 'souffle', 'while [ $# -gt 0 ]; do [ "$1" = -D ] && out=$2; shift; done\n' + script)
+    monkeypatch.setattr(evaluator.ESynth, 'SOUFFLE_EXE', exe)
+
+
+def unproduced(engine, rule_set):
+    outputs = engine.backend.evaluate(rule_set)
+    return [(rel, t) for rel, expected in sorted(engine.idbRelationsExpected.items())
+            for t in sorted(expected - outputs[rel])]
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_parallel_why_not_delta_matches_sequential(get_problem, backend):
+    problem = get_problem('sql-03')
+    engines = [ProSynth(problem, EFile.PUT, ['--backend', backend, '--jobs', jobs])
+               for jobs in ['1', '3']]
+    for engine in engines:
+        engine.setup()
+
+    try:
+        rng = random.Random(0)
+        names = sorted(engines[0].allRuleNames)
+        compared = 0
+        for p in [0, 0.05, 0.1, 0.2]:
+            rule_set = {name for name in names if rng.random() < p}
+            for rel, t in unproduced(engines[0], rule_set):
+                sequential, parallel = [engine.whyNotDelta(rel, t, set(rule_set))
+                                        for engine in engines]
+                assert sequential == parallel
+                compared += 1
+        assert compared
+    finally:
+        for engine in engines:
+            engine.close()
+
+
+def test_proof_rules_of_souffle_text():
+    assert ('value', 'Rule(6)') in list(text_tokens(SOUFFLE_PROOF))
+    assert proof_rules(SOUFFLE_PROOF, lambda *_: False) == {'3', '6'}
+    # the proof of a pruned premise is left out, not the premise of the reply itself
+    assert proof_rules(SOUFFLE_PROOF, lambda rel, t: rel == 'mid') == {'6'}
+    assert proof_rules(SOUFFLE_PROOF, lambda rel, t: rel == 'ans') == {'3', '6'}
+    assert proof_rules('{ "proof": { "axiom": "Tuple not found" } }', lambda *_: False) is None
+
+
+def test_text_and_tree_proofs_agree(get_problem):
+    problem = get_problem('sql-05')
+    backend = DatalogBackend(problem, f'{problem}/{ESynth.CANDIDATE_RULE_DL}', ['ans'])
+    with backend.session({'0', '2', '4', '6', '8'}) as session:
+        for t in sorted(session.outputs['ans']):
+            tree = session.explain('ans', t)
+            for text in [json.dumps(tree), json.dumps(tree, indent=1, separators=(' , ', ' : '))]:
+                assert list(text_tokens(text)) == list(tree_tokens(tree))
+                for pruned in [lambda *_: False, lambda rel, x: x == t]:
+                    assert proof_rules(text, pruned) == proof_rules(tree, pruned)
+
+
+class RecordingBackend(object):
+    """
+    Backend recording the rule sets of the sessions it opens
+    """
+
+    def __init__(self, base):
+        self.base = base
+        self.opened = []
+
+    def session(self, rule_set):
+        self.opened.append(rule_set)
+        return self.base.session(rule_set)
+
+
+def test_tiered_session_opens_provenance_on_first_explain(get_problem):
+    problem = get_problem('sql-05')
+    base = DatalogBackend(problem, f'{problem}/{ESynth.CANDIDATE_RULE_DL}', ['ans'])
+    backend = RecordingBackend(base)
+    rule_set = {'2', '8'}
+    outputs = base.evaluate(rule_set)
+    t = sorted(outputs['ans'])[0]
+    with base.session(rule_set) as session:
+        expected = session.explain('ans', t)
+
+    opened = []
+    with TieredSession(backend, rule_set, outputs, lambda: opened.append(True)) as session:
+        assert session.outputs == outputs
+        assert session.explain_all([]) == []
+        assert backend.opened == [] and opened == []
+
+        assert session.explain('ans', t) == expected
+        assert session.explain_all([('ans', t), ('ans', t)]) == [expected, expected]
+    assert backend.opened == [rule_set] and opened == [True]
+
+
+@pytest.mark.parametrize('name', ['sql-05', 'sql-09'])
+def test_tiered_search_solves(get_problem, name):
+    problem = get_problem(name)
+    engine = ProSynth(problem, EFile.PUT, ['--backend', 'python', '--tiered'])
+    result = engine.run()
+    assert result.status == SOLVED
+    assert engine.backend.evaluate(result.rules) == engine.idbRelationsExpected
+
+
+def test_compiled_program_is_cached_by_content(tmp_path, monkeypatch):
+    # souffle writes its flags as the C++ code, souffle-compile copies it as the executable and logs it
+    monkeypatch.setattr(evaluator.ESynth, 'SOUFFLE_EXE', executable(
+        tmp_path / 'souffle', 'while [ $# -gt 0 ]; do\n'
+                              '  [ "$1" = -g ] && cpp=$2; [ "$1" = -t ] && t=$2; shift\n'
+                              'done\n'
+                              'echo "$t" > $cpp\n'))
+    monkeypatch.setattr(evaluator, 'SOUFFLE_COMPILE', executable(
+        tmp_path / 'souffle-compile', 'echo "$1" >> "$(dirname "$1")/../compiled.log"\n'
+                                      'cp "$1" "${1%.cpp}" && chmod +x "${1%.cpp}"\n'))
+    program = tmp_path / 'rules.dl'
+    program.write_text('out(v0) :- inp(v0), Rule(1).\n')
+    bin_dir = str(tmp_path / 'bin')
+
+    exe = compile_program(str(program), bin_dir)
+    plain_exe = compile_program(str(program), bin_dir, provenance=False)
+    with open(exe) as fr, open(plain_exe) as fp:
+        assert (fr.read(), fp.read()) == ('explain\n', '\n')
+    assert os.access(exe, os.X_OK)
+    assert sorted(os.listdir(bin_dir)) == sorted(os.path.basename(f) for f in [exe, plain_exe])
+
+    # the same program is compiled once, a changed one afresh
+    assert compile_program(str(program), bin_dir) == exe
+    assert len((tmp_path / 'compiled.log').read_text().splitlines()) == 2
+    program.write_text('out(v0) :- inp(v0), Rule(2).\n')
+    assert compile_program(str(program), bin_dir) not in (exe, plain_exe)
+
+    # a program the toolchain fails on is interpreted, no partial build is left
+    monkeypatch.setattr(evaluator, 'SOUFFLE_COMPILE', executable(tmp_path / 'souffle-compile', 'exit 1\n'))
+    program.write_text('out(v0) :- inp(v0), Rule(3).\n')
+    assert compile_program(str(program), bin_dir) is None
+    assert len(os.listdir(bin_dir)) == 3
+
+
+def test_evaluate_outputs_reads_and_removes_csv_files(tmp_path, monkeypatch):
+    fake_souffle(tmp_path, monkeypatch, 'printf "a\\tb\\n" > $out/out.csv\n')
+    assert evaluate_outputs(str(tmp_path), 'dget.dl') == {'out': {('a', 'b')}}
+    assert not [f for f in os.listdir(tmp_path) if f.endswith('.csv')]
+
+
+def test_evaluate_outputs_reports_failures(tmp_path, monkeypatch):
+    fake_souffle(tmp_path, monkeypatch, 'exit 3\n')
+    for io in ['files', 'memory']:
+        with pytest.raises(SouffleError, match='code 3'):
+            evaluate_outputs(str(tmp_path), 'dget.dl', io)
+
+
+def test_evaluate_of_failed_souffle_raises(tmp_path, monkeypatch):
+    # the first run writes its output, the second one fails
+    fake_souffle(tmp_path, monkeypatch, '[ -e $out/ran ] && exit 2\n'
+                                        ': > $out/ran\nprintf "a\\n" > $out/out.csv\n')
+    backend = SouffleBackend(str(tmp_path), 'rules.dl', ['out'])
+    assert backend.evaluate({'1'}) == {'out': {('a',)}}
+    with pytest.raises(SouffleError, match='code 2'):
+        backend.evaluate({'1'})
+    assert not os.path.exists(tmp_path / 'out.csv')
+
+
+@pytest.mark.parametrize('queue_depth', [1, 3, 8])
+def test_pipelined_explain_replies_follow_queries(tmp_path, monkeypatch, queue_depth):
+    # every explain is answered by a line naming its query, other commands by an empty reply
+    fake_souffle(tmp_path, monkeypatch, ': > $out/out.csv\necho "###"\necho "###"\n'
+                                        'while read cmd args; do\n'
+                                        '  [ "$cmd" = exit ] && exit 0\n'
+                                        '  [ "$cmd" = explain ] && echo "proof of $args"\n'
+                                        '  echo "###"\n'
+                                        'done\n')
+    backend = SouffleBackend(str(tmp_path), 'rules.dl', ['out'], queue_depth=queue_depth)
+    queries = [('out', (str(i), f'x{i}')) for i in range(10)]
+    with backend.session({'1'}) as session:
+        assert session.outputs == {'out': set()}
+        replies = session.explain_all(queries)
+        assert session.explain('out', ('a', 'b')) == 'proof of out("a", "b")'
+    assert replies == [f'proof of out("{i}", "x{i}")' for i in range(10)]
+    assert session.proc.returncode == 0
+
+
+def test_session_of_exited_souffle_raises(tmp_path, monkeypatch):
+    fake_souffle(tmp_path, monkeypatch, 'echo partial output\nexit 4\n')
+    for io in ['files', 'memory']:
+        backend = SouffleBackend(str(tmp_path), 'rules.dl', ['out'], io=io)
+        with pytest.raises(SouffleError, match='code 4'):
+            with backend.session(set()):
+                pass
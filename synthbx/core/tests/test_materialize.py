@@ -0,0 +1,47 @@
+import os
+import random
+
+import pytest
+
+from synthbx.core.datalog import DatalogBackend
+from synthbx.core.materialize import materialize, MaterializedBackend
+from synthbx.core.prosynth import ProSynth, SOLVED
+from synthbx.env.const import EFile, ESynth
+
+
+def backend_of(problem):
+    relations = [f[:-len('.expected')] for f in os.listdir(problem) if f.endswith('.expected')]
+    return DatalogBackend(problem, f'{problem}/{ESynth.CANDIDATE_RULE_DL}', relations)
+
+
+@pytest.mark.parametrize('name', ['sql-03', 'sql-09', 'sql-10', 'sql-12', 'sql-14'])
+def test_materialized_outputs_match_evaluation(get_problem, name):
+    # sql-09 and later read relations invented by decompose, defined by candidate rules too
+    problem = get_problem(name)
+    backend = backend_of(problem)
+    materialized = materialize(backend, problem, f'{problem}/{ESynth.CANDIDATE_RULE_DL}')
+    assert type(materialized) is MaterializedBackend
+
+    rng = random.Random(0)
+    with open(f'{problem}/{ESynth.RULENAME_TXT}') as fr:
+        names = sorted(fr.read().split())
+    rule_sets = [set(), set(names)] + [{r for r in names if rng.random() < p}
+                                       for p in [0.1, 0.3, 0.5] for _ in range(5)]
+    for rule_set in rule_sets + rule_sets:
+        assert materialized.evaluate(rule_set) == backend.evaluate(rule_set), rule_set
+
+
+def test_recursive_program_is_not_materialized(get_problem):
+    problem = get_problem('sql-01')
+    backend = backend_of(problem)
+    assert materialize(backend, problem, f'{problem}/{ESynth.CANDIDATE_RULE_DL}') is backend
+
+
+@pytest.mark.parametrize('name', ['sql-05', 'sql-09'])
+def test_search_with_materialization_solves(get_problem, name):
+    problem = get_problem(name)
+    engine = ProSynth(problem, EFile.PUT, ['--backend', 'python', '--materialize'])
+    result = engine.run()
+    assert type(engine.backend) is MaterializedBackend
+    assert result.status == SOLVED
+    assert backend_of(problem).evaluate(result.rules) == engine.idbRelationsExpected
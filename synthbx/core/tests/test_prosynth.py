@@ -0,0 +1,336 @@
+import glob
+import json
+import os
+import re
+import shutil
+import time
+
+import pytest
+
+import synthbx.core.prosynth as prosynth
+import synthbx.core.synthesize as synthesize
+from synthbx.core.datalog import DatalogBackend
+from synthbx.core.evaluator import load_relation, SouffleError
+from synthbx.core.prosynth import ProSynth, SOLVED, TIMEOUT, UNSAT
+from synthbx.core.tests.conftest import BACKENDS
+from synthbx.env.const import EFile, EFolder, ESynth
+
+
+def solve(problem, options):
+    # the program is written as put next to problem, no put is synthesized for it
+    return ProSynth(problem, EFile.PUT, options).run()
+
+
+def stub_put(monkeypatch, pairs=lambda get: True, unpaired=lambda: False):
+    """
+    Make the synthesis of put pair a get whose text pairs holds for with an empty put, its decomposition
+    left as the get itself, and return unpaired() for the other gets; no souffle is needed
+    """
+    def p_synthesize(path, options=(), sy_path=None):
+        sy_path = sy_path or f'{path}/{EFolder.SYNTH}'
+        with open(f'{sy_path}/{EFile.GET}') as fr:
+            if not pairs(fr.read()):
+                return unpaired()
+        shutil.copy(f'{sy_path}/{EFile.GET}', f'{sy_path}/{EFile.DGET}')
+        for f in [EFile.CPUT, EFile.PUT]:
+            open(f'{sy_path}/{f}', 'w').close()
+        return True
+    monkeypatch.setattr(synthesize, 'p_synthesize', p_synthesize)
+
+
+def produces_expected(problem, rules):
+    expected = {f[:-len('.expected')]: load_relation(f'{problem}/{f}')
+                for f in os.listdir(problem) if f.endswith('.expected')}
+    backend = DatalogBackend(problem, f'{problem}/{ESynth.CANDIDATE_RULE_DL}', expected)
+    return backend.evaluate(rules) == expected
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+@pytest.mark.parametrize('name', ['sql-01', 'sql-05'])
+def test_parallel_search_with_why_budget_completes(get_problem, backend, name):
+    problem = get_problem(name)
+    sequential = solve(problem, ['--backend', backend, '--why-budget', '4'])
+    parallel = solve(problem, ['--backend', backend, '--why-budget', '4', '--jobs', '2',
+                               '--timeout', '120'])
+    assert sequential.status == parallel.status == SOLVED
+    assert sequential.rules == parallel.rules
+    assert produces_expected(problem, parallel.rules)
+
+
+def test_interleaved_searches_in_one_process_are_independent(get_problem):
+    problems = [get_problem('sql-05'), get_problem('sql-09')]
+    searches = [ProSynth(problem, EFile.PUT, ['--backend', 'python']).results() for problem in problems]
+    try:
+        found = [[], []]
+        for _ in range(2):
+            for i, search in enumerate(searches):
+                result = next(search)
+                assert result.status == SOLVED and produces_expected(problems[i], result.rules)
+                found[i].append(result.rules)
+        assert all(first != second for first, second in found)
+    finally:
+        for search in searches:
+            search.close()
+
+    # the command line of the engine runs in-process, its exit code telling whether it solved
+    data_file = f'{problems[0]}/../data.txt'
+    assert prosynth.main([problems[0], '0', '1', data_file, EFile.PUT, '--backend', 'python']) == 0
+    assert os.path.exists(f'{problems[0]}/../{EFile.PUT}') and os.path.getsize(data_file)
+    with open(f'{problems[0]}/ans.expected', 'a') as fa:
+        fa.write('PN99\n')
+    assert prosynth.main([problems[0], '0', '1', data_file, EFile.PUT, '--backend', 'python']) == 1
+
+
+@pytest.mark.parametrize('name', ['sql-01', 'sql-05', 'sql-09'])
+def test_warm_start_rerun_solves_identically(get_problem, name):
+    problem = get_problem(name)
+    options = ['--backend', 'python', '--warm-start']
+    first = solve(problem, options)
+    second = solve(problem, options)
+    assert first.status == second.status == SOLVED
+    assert produces_expected(problem, first.rules) and produces_expected(problem, second.rules)
+    assert second.counters.iterations <= first.counters.iterations
+
+    clauses, = glob.glob(f'{problem}/../_clauses/*.json')
+    with open(clauses) as fr:
+        saved = json.load(fr)['clauses']
+    assert saved and all(reason and 'visited' not in reason for _, _, reason in saved)
+
+
+@pytest.mark.parametrize('put_jobs', ['1', '2'])
+def test_warm_start_after_paired_get_still_solves(get_problem, monkeypatch, put_jobs):
+    stub_put(monkeypatch)
+    problem = get_problem('sql-05')
+    options = ['--backend', 'python', '--put-jobs', put_jobs, '--warm-start']
+    # sql-05 has three solutions, each excluded by a saved clause would leave none
+    for _ in range(4):
+        result = ProSynth(problem, EFile.GET, options).run()
+        assert result.status == SOLVED
+        assert produces_expected(problem, result.rules)
+
+
+@pytest.mark.parametrize('put_jobs', ['1', '2'])
+def test_pipelined_search_installs_the_paired_get(get_problem, monkeypatch, put_jobs):
+    # of the three gets of sql-05, only the one of rule 4 joins input2 twice and pairs, the others are slower
+    stub_put(monkeypatch, pairs=lambda get: get.count('input2(') == 3, unpaired=lambda: time.sleep(0.2))
+    problem = get_problem('sql-05')
+    sy_path = f'{problem}/..'
+
+    result = ProSynth(problem, EFile.GET, ['--backend', 'python', '--put-jobs', put_jobs]).run()
+    assert result.status == SOLVED and result.rules == {'4'}
+    with open(f'{sy_path}/{EFile.GET}') as fr:
+        assert fr.read().count('input2(') == 3
+    with open(f'{sy_path}/{EFile.DGET}') as fr, open(f'{sy_path}/{EFile.GET}') as fg:
+        assert fr.read() == fg.read()
+    assert not glob.glob(f'{sy_path}/put*/')
+
+
+def test_get_whose_put_fails_is_left_unpaired(get_problem, monkeypatch):
+    def fail():
+        raise SouffleError('souffle exited with code 1')
+    stub_put(monkeypatch, pairs=lambda get: get.count('input2(') == 3, unpaired=fail)
+    problem = get_problem('sql-05')
+
+    result = ProSynth(problem, EFile.GET, ['--backend', 'python']).run()
+    assert result.status == SOLVED and result.rules == {'4'}
+
+
+@pytest.mark.parametrize('name', ['sql-02', 'sql-05'])
+def test_enumeration_then_warm_start_run_still_solves(spec, monkeypatch, name):
+    stub_put(monkeypatch)
+    path = spec(name)
+    options = ['--backend', 'python', '--warm-start']
+
+    pairs = list(synthesize.enumerate_pairs(path, options, limit=3))
+    assert pairs and len({get for get, _, _ in pairs}) == len(pairs)
+
+    assert synthesize.synthesize(path, options).status == SOLVED
+    assert os.path.exists(f'{path}/{EFolder.RESULT}/{EFile.PUT}')
+
+
+def test_portfolio_keeps_the_folders_of_the_winning_run(spec, monkeypatch, capfd):
+    # runs are forked, they inherit the put pairing every get
+    stub_put(monkeypatch)
+    path = spec('sql-05')
+    configs = [['--optimize'], ['--coprov', '--tiered']]
+
+    winner = synthesize.portfolio(path, ['--backend', 'python'], 2, configs)
+    assert winner in (0, 1)
+    run_options = ['--backend', 'python'] + configs[winner]
+    assert f'Portfolio run {winner} {run_options}: solved' in capfd.readouterr().out
+    assert os.path.exists(f'{path}/{EFolder.RESULT}/{EFile.PUT}')
+    assert os.path.exists(f'{path}/{EFolder.SYNTH}/{synthesize.PORTFOLIO_LOG}')
+    assert not glob.glob(f'{path}/../.portfolio*')
+
+
+class Clock(object):
+    """
+    Clock of the search, standing still but for the seconds added by the test
+    """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def clock_gettime(self, clk_id):
+        return self.now
+
+    def advance(self, seconds=1):
+        self.now += seconds
+
+
+def test_resume_after_timeouts_ends_like_an_uninterrupted_search(get_problem, monkeypatch):
+    # every get is unpaired and takes a second, a run with a timeout of 3 s goes through 4 of them
+    clock = Clock()
+    monkeypatch.setattr(prosynth, 'time', clock)
+    stub_put(monkeypatch, pairs=lambda get: False, unpaired=clock.advance)
+    options = ['--backend', 'python', '--checkpoint', '3600']
+
+    full = ProSynth(get_problem('sql-03', 'full'), EFile.GET, options).run()
+    assert full.status != TIMEOUT and full.counters.gets > 10
+
+    problem = get_problem('sql-03', 'resumed')
+    checkpoint = f'{problem}/../_checkpoint/get.json'
+    result = ProSynth(problem, EFile.GET, options + ['--timeout', '3']).run()
+    assert result.status == TIMEOUT and result.counters.gets == 4 and os.path.exists(checkpoint)
+
+    # every resumed run has a budget of its own and goes further
+    while result.status == TIMEOUT:
+        gets = result.counters.gets
+        result = ProSynth(problem, EFile.GET, options + ['--timeout', '3', '--resume']).run()
+        assert gets < result.counters.gets <= gets + 4
+
+    assert result.status == full.status
+    assert result.counters.gets == full.counters.gets
+    assert not os.path.exists(checkpoint)
+
+
+# out(a) is derived by rule 1, which also derives the undesired out(b), or by rules 2 and 3
+TWO_DERIVATIONS = {
+    ESynth.CANDIDATE_RULE_DL: '''
+.decl Rule(v0: number)
+.input Rule
+
+.decl inp(v0: symbol)
+.input inp
+.decl good(v0: symbol)
+.input good
+.decl other(v0: symbol)
+.input other
+
+.decl mid(v0: symbol)
+.decl out(v0: symbol)
+.output out
+
+out(v0) :- inp(v0), Rule(1).
+out(v0) :- mid(v0), Rule(2).
+mid(v0) :- good(v0), Rule(3).
+mid(v0) :- other(v0), Rule(4).
+''',
+    ESynth.RULENAME_TXT: '1\n2\n3\n4\n',
+    'inp.facts': 'a\nb\n',
+    'good.facts': 'a\n',
+    'other.facts': 'd\n',
+    'out.expected': 'a\n',
+}
+
+
+@pytest.mark.parametrize('solver', ['cdcl', 'z3'])
+def test_proof_of_forbidden_rules_does_not_end_the_search(tmp_path, solver):
+    if solver == 'z3':
+        pytest.importorskip('z3')
+    problem = write_problem(tmp_path / 'problem', TWO_DERIVATIONS)
+    # the weighted selection starts from the empty candidate, out(a) is first constrained by the
+    # proof through rule 1 and rule 1 is then forbidden
+    result = solve(problem, ['--backend', 'python', '--solver', solver, '--optimize', '--whynot-proof'])
+    assert result.status == SOLVED and result.rules == {'2', '3'}
+
+
+NEGATED_RULE = {
+    ESynth.CANDIDATE_RULE_DL: '''
+.decl Rule(v0: number)
+.input Rule
+.decl inp(v0: symbol)
+.input inp
+.decl B(v0: symbol)
+.decl out(v0: symbol)
+.output out
+
+B(v0) :- inp(v0), Rule(1).
+out(v0) :- inp(v0), !B(v0), Rule(2).
+''',
+    ESynth.RULENAME_TXT: '1\n2\n',
+    'inp.facts': 'a\n',
+    'out.expected': 'a\n',
+}
+
+
+def write_problem(path, files):
+    path.mkdir()
+    for f, text in files.items():
+        (path / f).write_text(text)
+    return str(path)
+
+
+@pytest.mark.parametrize('options', [[], ['--coprov']])
+def test_program_negating_a_selected_rule_is_solved(tmp_path, options):
+    # enabling rule 1 removes out(a): neither co-provenance nor the exclusion of the supersets
+    # of a candidate lacking out(a) holds
+    problem = write_problem(tmp_path / 'problem', NEGATED_RULE)
+    engine = ProSynth(problem, EFile.PUT, ['--backend', 'python'] + options)
+    result = engine.run()
+    assert engine.setting_coprov == '0'
+    assert result.status == SOLVED and result.rules == {'2'}
+
+
+@pytest.mark.parametrize('name', ['sql-01', 'sql-05', 'sql-09'])
+def test_coprovenance_search_solves(get_problem, name):
+    problem = get_problem(name)
+    engine = ProSynth(problem, EFile.PUT, ['--backend', 'python', '--coprov'])
+    result = engine.run()
+    assert engine.setting_coprov == '1'
+    assert result.status == SOLVED and produces_expected(problem, result.rules)
+
+
+def test_setup_of_program_the_parser_rejects(tmp_path):
+    # Souffle evaluates aggregates, the parser of the repo does not know them
+    problem = tmp_path / 'problem'
+    problem.mkdir()
+    (problem / ESynth.CANDIDATE_RULE_DL).write_text('''
+.decl Rule(v0: number)
+.input Rule
+.decl emp(v0: symbol, v1: number)
+.input emp
+.decl top(v0: number)
+.output top
+top(max v1 : emp(_, v1)) :- emp(_, _), Rule(1).
+''')
+    (problem / ESynth.RULENAME_TXT).write_text('1\n')
+    (problem / 'emp.facts').write_text('a\t1\nb\t2\n')
+    (problem / 'top.expected').write_text('2\n')
+
+    for options in [[], ['--subsume', '--optimize', '--precheck', '--coprov']]:
+        engine = ProSynth(str(problem), EFile.PUT, options)
+        engine.setup()
+        assert engine.candidateDatalog is None and engine.provCache.cones == {}
+        assert engine.setting_coprov == '0'
+
+
+@pytest.mark.parametrize('solver', ['cdcl', 'z3'])
+def test_unsat_core_names_tuples_after_warm_start(get_problem, capsys, solver):
+    if solver == 'z3':
+        pytest.importorskip('z3')
+    problem = get_problem('sql-09')
+    # no candidate produces this tuple
+    with open(f'{problem}/ans.expected', 'a') as fa:
+        fa.write('9\tzz\ttreated\n')
+
+    options = ['--backend', 'python', '--solver', solver, '--warm-start']
+    # the first run may also exclude visited candidates, none of them is saved
+    for reason in [r'ans\(.*\) is (un)?desirable|the candidate was already visited', r'ans\(.*\) is (un)?desirable']:
+        result = ProSynth(problem, EFile.GET, options).run()
+        assert result.status == UNSAT
+        assert f'The {solver} solver finds no model' in capsys.readouterr().out
+        assert result.reasons
+        assert all(re.search(f'because ({reason})', line) for line in result.reasons)
+    # every clause learned from the other tuples holds for a solution of sql-09
+    assert any("ans('9', 'zz', 'treated')" in line for line in result.reasons)
@@ -0,0 +1,78 @@
+import itertools
+import random
+
+import pytest
+
+from synthbx.core.solver import CDCLSolver, make_solver, satisfies, unsat_core
+
+
+def random_clauses(rng, names, n):
+    clauses = []
+    for _ in range(n):
+        literals = rng.sample(names, rng.randint(1, 3))
+        pos = {name for name in literals if rng.random() < 0.5}
+        clauses.append((pos, set(literals) - pos))
+    return clauses
+
+
+def models(names, clauses):
+    for values in itertools.product([False, True], repeat=len(names)):
+        model = {name for name, value in zip(names, values) if value}
+        if all(satisfies(model, pos, neg) for pos, neg in clauses):
+            yield model
+
+
+@pytest.mark.parametrize('seed', range(40))
+def test_cdcl_agrees_with_brute_force(seed):
+    rng = random.Random(seed)
+    names = [str(i) for i in range(rng.randint(3, 8))]
+    solver = CDCLSolver(names)
+    clauses = []
+    # clauses are added incrementally, satisfiability is checked after each batch
+    for _ in range(4):
+        batch = random_clauses(rng, names, rng.randint(1, 8))
+        for pos, neg in batch:
+            solver.add_clause(pos, neg)
+        clauses += batch
+
+        assumptions = [(name, rng.random() < 0.5) for name in rng.sample(names, 2)]
+        constrained = clauses + [({name}, ()) if value else ((), {name})
+                                 for name, value in assumptions]
+        expected = next(models(names, constrained), None) is not None
+        assert solver.check(assumptions) == expected
+        if expected:
+            model = solver.model()
+            assert all(satisfies(model, pos, neg) for pos, neg in constrained)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_weighted_cdcl_model_is_subset_minimal(seed):
+    rng = random.Random(seed)
+    names = [str(i) for i in range(6)]
+    clauses = random_clauses(rng, names, 8)
+    solver = make_solver('cdcl', names, {name: rng.randint(1, 5) for name in names})
+    for pos, neg in clauses:
+        solver.add_clause(pos, neg)
+
+    all_models = list(models(names, clauses))
+    assert solver.check() == bool(all_models)
+    if all_models:
+        model = solver.model()
+        assert model in all_models
+        assert not any(other < model for other in all_models)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_unsat_core_is_unsatisfiable_and_minimal(seed):
+    rng = random.Random(seed)
+    names = [str(i) for i in range(4)]
+    clauses = random_clauses(rng, names, 30)
+    core = unsat_core(names, clauses)
+    if next(models(names, clauses), None) is not None:
+        assert core is None
+        return
+
+    assert next(models(names, [clauses[i] for i in core]), None) is None
+    for i in core:
+        rest = [clauses[j] for j in core if j != i]
+        assert next(models(names, rest), None) is not None
@@ -0,0 +1,100 @@
+import random
+
+import pytest
+
+from synthbx.core.datalog import Datalog
+from synthbx.core.materialize import parse_datalog, selectors
+from synthbx.core.prosynth import ProSynth, SOLVED
+from synthbx.core.subsume import structural_clauses, subsumes
+from synthbx.parser.program.parser import parse_program
+from synthbx.env.const import EFile, ESynth
+
+
+PROGRAM = '''
+.decl Rule(v0: number)
+.input Rule
+
+.decl edge(v0: number, v1: number)
+.input edge
+.decl mark(v0: number)
+.input mark
+
+.decl out(v0: number)
+.output out
+
+out(v0) :- edge(v0, v1), Rule(0).
+out(v0) :- edge(v0, v0), Rule(1).
+out(v0) :- edge(v0, v1), mark(v1), Rule(2).
+out(v2) :- edge(v2, v3), Rule(3).
+out(v0) :- edge(v0, v1), !mark(v1), Rule(4).
+out(v0) :- edge(v0, v1), v1 = 2, Rule(5).
+out(v0) :- edge(v0, 2), Rule(6).
+out(v0) :- edge(v0, v1), v1 < 2, Rule(7).
+'''
+
+
+@pytest.fixture
+def clauses():
+    datalog = Datalog(parse_program(PROGRAM))
+    return {next(iter(selectors(c))): c for c in datalog.clauses}
+
+
+def test_subsumes(clauses):
+    # more general clauses subsume their specializations, not the other way round
+    for general, special in [('0', '1'), ('0', '2'), ('0', '4'), ('0', '6'), ('0', '7')]:
+        assert subsumes(clauses[general], clauses[special])
+        assert not subsumes(clauses[special], clauses[general])
+    assert not subsumes(clauses['2'], clauses['4'])
+    assert not subsumes(clauses['4'], clauses['2'])
+
+    # renamed variables and equalities read as constants give equivalent clauses
+    for x, y in [('0', '3'), ('5', '6')]:
+        assert subsumes(clauses[x], clauses[y]) and subsumes(clauses[y], clauses[x])
+
+
+def test_structural_clauses_keep_first_of_equivalent_rules():
+    datalog = Datalog(parse_program(PROGRAM))
+    ans = structural_clauses(datalog, [str(r) for r in range(8)])
+    assert all(pos == () for pos, _ in ans)
+    negs = [neg for _, neg in ans]
+    assert {'3'} in negs and {'6'} in negs
+    assert {'0'} not in negs and {'5'} not in negs
+    assert {'0', '1'} in negs and {'0', '5'} in negs
+
+
+@pytest.mark.parametrize('name', ['sql-03', 'sql-05', 'sql-09'])
+def test_subsumed_rule_never_changes_outputs(get_problem, name):
+    problem = get_problem(name)
+    datalog = parse_datalog(problem, f'{problem}/{ESynth.CANDIDATE_RULE_DL}')
+    by_rule = {}
+    for c in datalog.clauses:
+        names = selectors(c)
+        if names is not None and len(names) == 1:
+            by_rule.setdefault(next(iter(names)), []).append(c)
+    by_rule = {r: cs[0] for r, cs in by_rule.items() if len(cs) == 1}
+
+    pairs = [(a, b) for a in by_rule for b in by_rule
+             if a != b and subsumes(by_rule[a], by_rule[b])]
+
+    def outputs(rule_set):
+        relations = datalog.evaluate(rule_set).relations
+        return {rel_name: ts for rel_name, ts in relations.items() if rel_name != 'Rule'}
+
+    rng = random.Random(0)
+    assert pairs
+    for a, b in pairs:
+        for _ in range(5):
+            rule_set = {r for r in by_rule if rng.random() < 0.2} | {a}
+            assert outputs(rule_set | {b}) == outputs(rule_set - {b}), (a, b, rule_set)
+
+
+@pytest.mark.parametrize('name', ['sql-01', 'sql-05'])
+def test_search_with_subsumption_solves(get_problem, name):
+    problem = get_problem(name)
+    engine = ProSynth(problem, EFile.PUT, ['--backend', 'python', '--subsume'])
+    result = engine.run()
+    assert result.status == SOLVED
+    datalog = parse_datalog(problem, f'{problem}/{ESynth.CANDIDATE_RULE_DL}')
+    outputs = datalog.evaluate(result.rules).relations
+    for rel_name, expected in engine.idbRelationsExpected.items():
+        assert outputs[rel_name] == expected